@@ -0,0 +1,76 @@
+"""Measure the time spent to handle responses of a large event list action
+and the latency of ``async for`` over it.
+
+Usage::
+
+    $ python benchmarks/bench_actions.py -n 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from panoramisk.actions import Action
+from panoramisk.message import Message
+
+
+def messages(count):
+    yield Message({'Response': 'Success', 'EventList': 'start',
+                   'Message': 'Channels will follow'})
+    for i in range(count):
+        yield Message({'Event': 'CoreShowChannel',
+                       'Channel': 'SIP/%04d-00000001' % i})
+    yield Message({'Event': 'CoreShowChannelsComplete',
+                   'EventList': 'Complete',
+                   'ListItems': str(count)})
+
+
+async def produce(action, count, sent):
+    for message in messages(count):
+        sent.append(time.perf_counter())
+        action.add_message(message)
+        # one frame per loop iteration
+        await asyncio.sleep(0)
+
+
+def throughput(count):
+    responses = list(messages(count))
+    action = Action({'Action': 'CoreShowChannels'})
+    start = time.perf_counter()
+    for message in responses:
+        action.add_message(message)
+    elapsed = time.perf_counter() - start
+    assert len(action.result()) == count + 2
+    print('add_message for %d items: %.3fs (%.0f items/s)' % (
+        len(responses), elapsed, len(responses) / elapsed))
+
+
+async def latency(count):
+    action = Action({'Action': 'CoreShowChannels'})
+    sent = []
+    delays = []
+    start = time.perf_counter()
+    producer = asyncio.ensure_future(produce(action, count, sent))
+    async for message in action:
+        delays.append(time.perf_counter() - sent[len(delays)])
+    elapsed = time.perf_counter() - start
+    await producer
+    delays.sort()
+    print('async for over %d items: %.3fs' % (len(delays), elapsed))
+    print('latency mean %.3fms p50 %.3fms p99 %.3fms max %.3fms' % (
+        statistics.mean(delays) * 1000,
+        delays[len(delays) // 2] * 1000,
+        delays[int(len(delays) * .99)] * 1000,
+        delays[-1] * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--items', type=int, default=5000)
+    args = parser.parse_args(argv)
+    throughput(args.items)
+    asyncio.run(latency(args.items))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measure AMIProtocol.data_received throughput.
+
+Usage::
+
+    $ python benchmarks/bench_ami_protocol.py -n 20000
+"""
+import argparse
+import time
+
+from panoramisk import Manager
+from panoramisk import utils
+from panoramisk.ami_protocol import AMIProtocol
+
+
+def event(i):
+    return utils.EOL.join([
+        'Event: QueueMember',
+        'Queue: queue-%d' % (i % 10),
+        'Name: SIP/%04d' % i,
+        'Location: SIP/%04d' % i,
+        'StateInterface: SIP/%04d' % i,
+        'Membership: dynamic',
+        'Penalty: 0',
+        'CallsTaken: 0',
+        'LastCall: 0',
+        'Status: 1',
+        'Paused: 0',
+    ]) + utils.EOL + utils.EOL
+
+
+def protocol():
+    manager = Manager()
+    manager.register_event('QueueMember', lambda manager, event: None)
+    proto = AMIProtocol()
+    proto.connection_made(None)
+    proto.factory = manager
+    proto.encoding = 'utf8'
+    return proto
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def run(name, data, count):
+    proto = protocol()
+    start = time.perf_counter()
+    for chunk in data:
+        proto.data_received(chunk)
+    elapsed = time.perf_counter() - start
+    print('%-24s %8d events %8.3fs %10.0f events/s' % (
+        name, count, elapsed, count / elapsed))
+    return count / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--events', type=int, default=20000)
+    args = parser.parse_args(argv)
+    stream = ''.join(event(i) for i in range(args.events)).encode()
+    run('coalesced (64KiB)', chunks(stream, 65536), args.events)
+    run('fragmented (1460B)', chunks(stream, 1460), args.events)
+    run('fragmented (64B)', chunks(stream, 64), args.events)
+    # one big Command output split in many TCP segments
+    body = utils.EOL.join(['Output: line %d' % i for i in range(args.events)])
+    big = ('Response: Success' + utils.EOL + body +
+           utils.EOL + utils.EOL).encode()
+    run('single large frame', chunks(big, 1460), 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Drive a real Manager against panoramisk.testing.AMIServer and report
+events/s, action round trip percentiles and memory per connection.
+
+Usage::
+
+    $ python benchmarks/bench_ami_server.py -n 100000 -a 5000 -c 50
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from panoramisk import Manager
+from panoramisk import testing
+
+
+def percentiles(values):
+    values = sorted(values)
+    result = []
+    for p in (50, 90, 99):
+        result.append('p%d %.3fms' % (p, values[len(values) * p // 100] * 1000))
+    result.append('max %.3fms' % (values[-1] * 1000))
+    return ' '.join(result)
+
+
+async def connect(port, **config):
+    manager = Manager(port=port, username='username', secret='secret',
+                      loop=asyncio.get_event_loop(), **config)
+    await manager.connect()
+    await manager.authenticated_future
+    return manager
+
+
+async def events(server, port, count):
+    manager = await connect(port)
+    received = [0]
+
+    @manager.register_event('VarSet')
+    def callback(manager, event):
+        received[0] += 1
+
+    start = time.perf_counter()
+    await server.emit(count)
+    while received[0] < count:
+        await asyncio.sleep(.001)
+    elapsed = time.perf_counter() - start
+    print('events: %d in %.3fs, %.0f events/s' % (
+        count, elapsed, count / elapsed))
+    manager.close()
+
+
+async def actions(port, count):
+    manager = await connect(port, events='off')
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        await manager.send_action({'Action': 'Ping'})
+        durations.append(time.perf_counter() - start)
+    print('sequential ping rtt: %s' % percentiles(durations))
+
+    async def ping():
+        start = time.perf_counter()
+        await manager.send_action({'Action': 'Ping'})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    durations = await asyncio.gather(*[ping() for i in range(count)])
+    elapsed = time.perf_counter() - start
+    print('concurrent ping rtt: %s, %.0f actions/s' % (
+        percentiles(durations), count / elapsed))
+    manager.close()
+
+
+async def memory(port, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    managers = [await connect(port) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    print('memory: %.1f KiB per connection' % (size / count / 1024))
+    for manager in managers:
+        manager.close()
+
+
+async def run(args):
+    server = testing.AMIServer(username='username', secret='secret')
+    port = await server.start()
+    await events(server, port, args.events)
+    await actions(port, args.actions)
+    await memory(port, args.connections)
+    server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--events', type=int, default=100000)
+    parser.add_argument('-a', '--actions', type=int, default=5000)
+    parser.add_argument('-c', '--connections', type=int, default=50)
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compare utils.CaseInsensitiveDict with the previous implementation which
+lowercased keys on each access and went through ``MutableMapping.get``.
+
+Usage::
+
+    $ python benchmarks/bench_case_insensitive_dict.py -n 100000
+"""
+import argparse
+import time
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # pragma: no cover
+    from collections import MutableMapping
+
+from panoramisk.utils import CaseInsensitiveDict
+
+HEADERS = [
+    ('Event', 'Newchannel'), ('Privilege', 'call,all'),
+    ('Channel', 'SIP/0001-00000001'), ('ChannelState', '0'),
+    ('ChannelStateDesc', 'Down'), ('CallerIDNum', '0001'),
+    ('CallerIDName', 'User'), ('Context', 'default'), ('Exten', '100'),
+    ('Priority', '1'), ('Uniqueid', '1437920906.0'),
+    ('Linkedid', '1437920906.0'), ('ActionID', 'action/1'),
+]
+
+
+class LegacyCaseInsensitiveDict(MutableMapping):
+
+    def __init__(self, data=None, **kwargs):
+        self._store = dict()
+        self.update(data or {}, **kwargs)
+
+    def __setitem__(self, key, value):
+        self._store[key.lower()] = (key, value)
+
+    def __contains__(self, key):
+        return key.lower() in self._store
+
+    def __getattr__(self, attr):
+        return self.get(attr, '')
+
+    def __getitem__(self, key):
+        return self._store[key.lower()][1]
+
+    def __delitem__(self, key):
+        raise NotImplementedError()
+
+    def __iter__(self):
+        return (key for key, value in self._store.values())
+
+    def __len__(self):
+        return len(self._store)
+
+
+def build(klass, count):
+    headers = dict(HEADERS)
+    start = time.perf_counter()
+    for i in range(count):
+        klass(headers)
+    return time.perf_counter() - start
+
+
+def lookups(klass, count):
+    cid = klass(dict(HEADERS))
+    start = time.perf_counter()
+    for i in range(count):
+        cid['Event']
+        cid.actionid
+        cid.get('Uniqueid')
+        'commandid' in cid
+        cid.missing
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=100000)
+    args = parser.parse_args(argv)
+    for name, func in (('build', build), ('lookups', lookups)):
+        legacy = func(LegacyCaseInsensitiveDict, args.count)
+        current = func(CaseInsensitiveDict, args.count)
+        print('%-8s legacy %.3fs current %.3fs (x%.1f)' % (
+            name, legacy, current, legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compare Manager.dispatch with a linear scan of all registered patterns.
+
+Usage::
+
+    $ python benchmarks/bench_dispatch.py -n 100000
+"""
+import argparse
+import asyncio
+import time
+
+from panoramisk import Manager
+from panoramisk.message import Message
+
+EVENTS = ['Newexten', 'VarSet', 'QueueMemberStatus', 'QueueCallerJoin',
+          'AgentCalled', 'Hangup', 'PeerStatus', 'RTCPSent', 'DialBegin']
+
+
+def callback(manager, event):
+    pass
+
+
+def linear_dispatch(manager, event):
+    # dispatch as it was done before the patterns index
+    matches = []
+    event.manager = manager
+    for pattern, regexp in manager.patterns:
+        match = regexp.match(event.event)
+        if match is not None:
+            matches.append(pattern)
+            for callback in manager.callbacks[pattern]:
+                ret = callback(manager, event)
+                if (asyncio.iscoroutine(ret) or
+                        isinstance(ret, asyncio.Future)):
+                    asyncio.ensure_future(ret, loop=manager.loop)
+    return matches
+
+
+def manager(count):
+    manager = Manager()
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            pattern = 'Tenant%dEvent' % i
+        elif kind == 1:
+            pattern = 'Queue%d*' % i
+        elif kind == 2:
+            pattern = 'UserEvent%d' % i
+        else:
+            pattern = 'Agent%d*' % i
+        manager.register_event(pattern, callback)
+    manager.register_event('Queue*', callback)
+    manager.register_event('Hangup', callback)
+    return manager
+
+
+def run(name, dispatch, events):
+    start = time.perf_counter()
+    for event in events:
+        dispatch(event)
+    elapsed = time.perf_counter() - start
+    print('%-24s %10.0f events/s' % (name, len(events) / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--events', type=int, default=100000)
+    args = parser.parse_args(argv)
+    events = [Message({'Event': EVENTS[i % len(EVENTS)]})
+              for i in range(args.events)]
+    for count in (10, 100, 1000):
+        m = manager(count)
+        run('linear (%d patterns)' % count,
+            lambda e: linear_dispatch(m, e), events)
+        run('indexed (%d patterns)' % count, m.dispatch, events)
+
+
+if __name__ == '__main__':
+    main()
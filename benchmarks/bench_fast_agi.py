@@ -0,0 +1,124 @@
+"""FastAGI load generator. Measure call setups per second: clients connect,
+send the AGI headers and wait for the server to close the connection.
+
+The server is run with ``Application.serve()`` for each number of workers
+and the load is generated by several client processes::
+
+    $ python benchmarks/bench_fast_agi.py -n 20000 --workers 1 2 4
+
+``--cpu`` adds some CPU work (in milliseconds) to each call.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from panoramisk.fast_agi import Application
+
+HEADERS = (
+    'network: yes', 'network_script: bench',
+    'request: agi://127.0.0.1:4574/bench', 'channel: SIP/xxxxxx-00000000',
+    'language: en_US', 'type: SIP', 'uniqueid: 1437920906.0',
+    'version: asterisk', 'callerid: 201', 'calleridname: user 201',
+    'callingpres: 0', 'callingani2: 0', 'callington: 0', 'callingtns: 0',
+    'dnid: 9011', 'rdnis: unknown', 'context: default', 'extension: 9011',
+    'priority: 2', 'enhanced: 0.0', 'accountcode: default',
+    'threadid: -1260881040', 'arg_1: answered',
+)
+
+PAYLOAD = (''.join('agi_%s\n' % h for h in HEADERS) + '\n').encode()
+
+
+def application(cpu):
+    async def bench(request):
+        end = time.perf_counter() + cpu / 1000.
+        while time.perf_counter() < end:
+            pass
+
+    app = Application()
+    app.add_route('bench', bench)
+    return app
+
+
+async def client(port, count, chunk_size):
+    for i in range(count):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        # Asterisk usually sends headers in a few packets
+        for j in range(0, len(PAYLOAD), chunk_size):
+            writer.write(PAYLOAD[j:j + chunk_size])
+        await reader.read()
+        writer.close()
+
+
+def load(port, count, concurrency, chunk_size):
+    async def run():
+        await asyncio.gather(*[
+            client(port, count // concurrency, chunk_size)
+            for i in range(concurrency)])
+    asyncio.run(run())
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_server(port):
+    for i in range(100):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            time.sleep(.05)
+        else:
+            with sock:
+                sock.sendall(PAYLOAD)
+                sock.recv(1)
+            return
+
+
+def bench_workers(workers, args):
+    context = multiprocessing.get_context('fork')
+    port = free_port()
+    server = context.Process(
+        target=application(args.cpu).serve,
+        kwargs=dict(host='127.0.0.1', port=port, workers=workers))
+    server.start()
+    wait_server(port)
+    per_client = args.count // args.clients
+    concurrency = max(1, args.concurrency // args.clients)
+    clients = [context.Process(target=load, args=(port, per_client,
+                                                  concurrency,
+                                                  args.chunk_size))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for process in clients:
+        process.start()
+    for process in clients:
+        process.join()
+    elapsed = time.perf_counter() - start
+    server.terminate()
+    server.join()
+    total = per_client // concurrency * concurrency * args.clients
+    print('%d workers: %d call setups in %.3fs (%.0f/s)' % (
+        workers, total, elapsed, total / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Number of client processes')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--cpu', type=float, default=0,
+                        help='CPU time spent in each call (ms)')
+    parser.add_argument('--chunk-size', type=int, default=512)
+    args = parser.parse_args(argv)
+    for workers in args.workers:
+        bench_workers(workers, args)
+
+
+if __name__ == '__main__':
+    main()
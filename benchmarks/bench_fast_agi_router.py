@@ -0,0 +1,63 @@
+"""Compare FastAGI route lookups: a flat dict of every script, the Router
+with one template per route and a linear scan of compiled regexps.
+
+Usage::
+
+    $ python benchmarks/bench_fast_agi_router.py -r 500 -n 100000
+"""
+import argparse
+import random
+import re
+import time
+
+from panoramisk.fast_agi import Router
+
+MENUS = ['main', 'sales', 'support', 'billing', 'night']
+
+
+def scripts(routes, tenants):
+    for i in range(routes):
+        for tenant in range(tenants):
+            for menu in MENUS:
+                yield 'app%d/tenant/%d/ivr/%s' % (i, tenant, menu)
+
+
+def measure(name, lookup, paths):
+    start = time.perf_counter()
+    for path in paths:
+        assert lookup(path) is not None
+    elapsed = time.perf_counter() - start
+    print('%-8s %.3fs (%.0f lookups/s)' % (name, elapsed,
+                                           len(paths) / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--routes', type=int, default=500)
+    parser.add_argument('-t', '--tenants', type=int, default=20)
+    parser.add_argument('-n', '--lookups', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    flat = dict.fromkeys(scripts(args.routes, args.tenants), True)
+    router = Router()
+    regexps = []
+    for i in range(args.routes):
+        router.add('app%d/tenant/{tenant:int}/ivr/{menu}' % i)
+        regexps.append(re.compile(
+            r'^app%d/tenant/(?P<tenant>\d+)/ivr/(?P<menu>[^/]+)$' % i))
+
+    def scan(path):
+        for regexp in regexps:
+            match = regexp.match(path)
+            if match is not None:
+                return match.groupdict()
+
+    paths = random.choices(list(flat), k=args.lookups)
+    print('%d routes, %d scripts' % (args.routes, len(flat)))
+    measure('dict', flat.get, paths)
+    measure('router', router.match, paths)
+    measure('regexps', scan, paths[:args.lookups // 10])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Replay a recording made with ``panoramisk.recording.Recorder`` as fast as
+possible and report the throughput. Use it to compare parser changes
+against real captures.
+
+Usage::
+
+    $ python benchmarks/bench_replay.py /var/log/ami.rec
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from panoramisk import Manager
+from panoramisk.recording import replay
+
+
+async def run(path, pattern):
+    events = [0]
+
+    def callback(manager, event):
+        events[0] += 1
+
+    manager = Manager()
+    manager.register_event(pattern, callback)
+    start = time.perf_counter()
+    chunks = await replay(manager, path)
+    elapsed = time.perf_counter() - start
+    manager.close()
+    size = os.path.getsize(path)
+    print('%d chunks, %d events in %.3fs: %.0f events/s, %.1f MB/s' % (
+        chunks, events[0], elapsed, events[0] / elapsed,
+        size / elapsed / 1024 / 1024))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('-p', '--pattern', default='*',
+                        help='Pattern of the events to dispatch')
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.path, args.pattern))
+
+
+if __name__ == '__main__':
+    main()
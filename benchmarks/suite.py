@@ -0,0 +1,251 @@
+"""Micro benchmarks of panoramisk's hot paths.
+
+Results are stored as json (in ``benchmarks/results/<git revision>.json`` by
+default) and can be compared with a previous run. Benchmarks slower than
+``--threshold`` are reported as regressions and make the script exit with
+an error.
+
+Usage::
+
+    $ python benchmarks/suite.py
+    $ python benchmarks/suite.py --compare benchmarks/results/abc1234.json
+    $ python benchmarks/suite.py -k dispatch
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+from panoramisk import Manager
+from panoramisk import fast_agi
+from panoramisk import utils
+from panoramisk.actions import Action
+from panoramisk.ami_protocol import AMIProtocol
+from panoramisk.message import Message
+
+benchmarks = {}
+
+
+def bench(func):
+    """Register a benchmark. The function returns the callable to time"""
+    benchmarks[func.__name__] = func
+    return func
+
+
+def event(i):
+    return utils.EOL.join([
+        'Event: QueueMember',
+        'Queue: queue-%d' % (i % 10),
+        'Name: SIP/%04d' % i,
+        'Location: SIP/%04d' % i,
+        'Membership: dynamic',
+        'Penalty: 0',
+        'CallsTaken: 0',
+        'Status: 1',
+        'Paused: 0',
+    ])
+
+
+@bench
+def message_from_line():
+    line = event(1)
+    return lambda: Message.from_line(line)
+
+
+@bench
+def message_parse():
+    line = event(1)
+    return lambda: Message.from_line(line).name
+
+
+@bench
+def protocol_fragmented():
+    stream = ''.join(event(i) + utils.EOL * 2 for i in range(100)).encode()
+    chunks = [stream[i:i + 64] for i in range(0, len(stream), 64)]
+    manager = Manager()
+    manager.register_event('QueueMember', lambda manager, event: None)
+
+    def run():
+        protocol = AMIProtocol()
+        protocol.connection_made(None)
+        protocol.factory = manager
+        for chunk in chunks:
+            protocol.data_received(chunk)
+    return run
+
+
+@bench
+def dispatch_1000_patterns():
+    manager = Manager()
+    for i in range(1000):
+        manager.register_event('UserEvent%d' % i, lambda manager, event: None)
+        manager.register_event('Queue%d*' % i, lambda manager, event: None)
+    manager.register_event('Queue*', lambda manager, event: None)
+    events = [Message({'Event': name}) for name in (
+        'QueueMember', 'Newexten', 'VarSet', 'Hangup', 'QueueCallerJoin')]
+
+    def run():
+        for e in events:
+            manager.dispatch(e)
+    return run
+
+
+@bench
+def action_event_list():
+    messages = [Message({'Response': 'Success', 'EventList': 'start',
+                         'Message': 'Queue status will follow'})]
+    messages.extend(Message({'Event': 'QueueMember', 'Name': str(i)})
+                    for i in range(1000))
+    messages.append(Message({'Event': 'QueueStatusComplete',
+                             'EventList': 'Complete'}))
+
+    def run():
+        action = Action({'Action': 'QueueStatus'})
+        for message in messages:
+            action.add_message(message)
+        assert action.done()
+    return run
+
+
+@bench
+def case_insensitive_dict():
+    cid = utils.CaseInsensitiveDict({'Event': 'Hangup', 'Channel': 'SIP/1',
+                                     'Uniqueid': '1.1', 'ActionID': '1'})
+
+    def run():
+        cid['Cause'] = '16'
+        return (cid['event'], cid.channel, 'actionid' in cid,
+                cid.get('uniqueid'), cid.unknown)
+    return run
+
+
+@bench
+def id_generator():
+    generator = utils.IdGenerator('bench')
+    return generator
+
+
+@bench
+def parse_agi_result():
+    return lambda: utils.parse_agi_result('200 result=1 (SIP/000000)')
+
+
+AGI_HEADERS = (
+    'network: yes', 'network_script: bench',
+    'request: agi://127.0.0.1:4574/bench', 'channel: SIP/xxxxxx-00000000',
+    'language: en_US', 'type: SIP', 'uniqueid: 1437920906.0',
+    'version: asterisk', 'callerid: 201', 'calleridname: user 201',
+    'callingpres: 0', 'callingani2: 0', 'callington: 0', 'callingtns: 0',
+    'dnid: 9011', 'rdnis: unknown', 'context: default', 'extension: 9011',
+    'priority: 2', 'enhanced: 0.0', 'accountcode: default',
+    'threadid: -1260881040', 'arg_1: answered',
+)
+
+
+class AGIWriter:
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def get_extra_info(self, name):
+        return None
+
+    def close(self):
+        pass
+
+
+@bench
+def fast_agi_request_setup():
+    payload = ''.join('agi_%s\n' % h for h in AGI_HEADERS) + '\n'
+    payload = payload.encode()
+    loop = asyncio.new_event_loop()
+    app = fast_agi.Application(loop=loop)
+
+    async def route(request):
+        pass
+
+    app.add_route('bench', route)
+
+    async def requests():
+        for i in range(100):
+            reader = asyncio.StreamReader()
+            reader.feed_data(payload)
+            reader.feed_eof()
+            await app.handler(reader, AGIWriter())
+
+    return lambda: loop.run_until_complete(requests())
+
+
+def timing(func, repeat=5, min_time=.2):
+    timer = timeit.Timer(func)
+    number, __ = timer.autorange()
+    number = max(1, int(number * min_time / .2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):  # pragma: no cover
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--keyword', default='',
+                        help='Only run benchmarks containing this keyword')
+    parser.add_argument('-o', '--output',
+                        help='Results file. Default to '
+                             'benchmarks/results/<revision>.json')
+    parser.add_argument('-c', '--compare', help='Previous results file')
+    parser.add_argument('-t', '--threshold', type=float, default=.1,
+                        help='Slowdown ratio reported as a regression')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rev = revision()
+    results = {}
+    for name, func in sorted(benchmarks.items()):
+        if args.keyword in name:
+            results[name] = timing(func(), repeat=args.repeat)
+            print('%-28s %12.3f us' % (name, results[name] * 1e6))
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results', rev + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as fd:
+        json.dump({'revision': rev,
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'results': results}, fd, indent=2, sort_keys=True)
+    print('Results saved to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as fd:
+            previous = json.load(fd)
+        regressions = []
+        print('Compared with %s' % previous['revision'])
+        for name, value in sorted(results.items()):
+            if name not in previous['results']:
+                continue
+            ratio = value / previous['results'][name]
+            status = ''
+            if ratio > 1 + args.threshold:
+                status = 'REGRESSION'
+                regressions.append(name)
+            print('%-28s %6.2fx %s' % (name, ratio, status))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
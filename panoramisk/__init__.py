@@ -1,4 +1,6 @@
 from .manager import Manager  # NOQA
 from .message import Message  # NOQA
 from .call_manager import CallManager  # NOQA
+from .pool import PoolManager  # NOQA
+from .cluster import Cluster  # NOQA
 from . import fast_agi  # NOQA
@@ -1,6 +1,27 @@
 import asyncio
+import collections
+import heapq
+import itertools
+import time
 
 from . import utils
+from .exceptions import TooManyResponses
+
+
+terminal_events = {'AsyncAGIExec': True}
+terminal_subevents = frozenset(('End', 'Exec'))
+terminal_responses = frozenset(('Success', 'Error', 'Fail', 'Failure'))
+
+
+def is_terminal_event(name):
+    """Return True if an event ends an action's responses. Results are
+    cached by event name"""
+    terminal = terminal_events.get(name)
+    if terminal is None:
+        terminal = name.endswith('Complete')
+        if len(terminal_events) < 1024:
+            terminal_events[name] = terminal
+    return terminal
 
 
 class Action(utils.CaseInsensitiveDict, asyncio.Future):
@@ -15,13 +36,13 @@ class Action(utils.CaseInsensitiveDict, asyncio.Future):
         >>> action = Action({'Action': 'Status'})
         >>> print(action) # doctest: +NORMALIZE_WHITESPACE
         Action: Status
-        ActionID: action/myuuid/1/1
+        ActionID: action/myuuid/1
 
         >>> action = Action({'Action': 'SIPnotify',
         ...                  'Variable': ['1', '2']})
         >>> print(action) # doctest: +NORMALIZE_WHITESPACE
         Action: SIPnotify
-        ActionID: action/myuuid/1/2
+        ActionID: action/myuuid/2
         Variable: 1
         Variable: 2
     """
@@ -30,12 +51,23 @@ class Action(utils.CaseInsensitiveDict, asyncio.Future):
 
     def __init__(self, *args, **kwargs):
         self.as_list = kwargs.pop('as_list', None)
+        self.replay_priority = kwargs.pop('replay_priority', 0)
+        self.replay_ttl = kwargs.pop('replay_ttl', None)
+        self.stream = kwargs.pop('stream', False)
+        self.max_responses = kwargs.pop('max_responses', None)
+        self.response_timeout = kwargs.pop('response_timeout', None)
         super(Action, self).__init__(*args, **kwargs)
         asyncio.Future.__init__(self)
         if 'actionid' not in self:
             self['ActionID'] = self.action_id_generator()
         self.responses = []
         self.responses_index = 0
+        self.waiter = None
+        self.sent_at = None
+        self.timeout_entry = None
+        self._multi = None
+        self.received = 0
+        self.overflowed = False
 
     def __aiter__(self):
         return self
@@ -45,11 +77,29 @@ class Action(utils.CaseInsensitiveDict, asyncio.Future):
             if self.responses_index < len(self.responses):
                 res = self.responses[self.responses_index]
                 self.responses_index += 1
+                if self.stream:
+                    self.release()
                 return res
             elif self.done():
+                if not self.cancelled() and self.exception() is not None:
+                    raise self.exception()
                 raise StopAsyncIteration
             else:
-                await asyncio.sleep(.1)
+                if self.waiter is None:
+                    self.add_done_callback(self.wakeup)
+                self.waiter = self.get_loop().create_future()
+                await self.waiter
+
+    def release(self):
+        """Forget the responses already consumed by a streaming iterator"""
+        if self.responses_index * 2 >= len(self.responses):
+            del self.responses[:self.responses_index]
+            self.responses_index = 0
+
+    def wakeup(self, *args):
+        """Wake up the iterator waiting for a response"""
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
 
     @property
     def id(self):
@@ -69,11 +119,16 @@ class Action(utils.CaseInsensitiveDict, asyncio.Future):
 
     @property
     def multi(self):
-        resp = self.responses[0]
-        msg = resp.message.lower()
         if self.as_list is not None:
             return bool(self.as_list)
-        elif resp.subevent == 'Start':
+        if self._multi is None:
+            # only depends on the first response
+            self._multi = self.is_multi(self.responses[0])
+        return self._multi
+
+    def is_multi(self, resp):
+        msg = resp.message.lower()
+        if resp.subevent == 'Start':
             return True
         elif 'EventList' in resp and resp['EventList'] == 'start':
             return True
@@ -89,30 +144,50 @@ class Action(utils.CaseInsensitiveDict, asyncio.Future):
 
     @property
     def completed(self):
-        resp = self.responses[-1]
-        if resp.event.endswith('Complete'):
-            return True
-        elif resp.subevent in ('End', 'Exec'):
+        return self.is_completed(self.responses[-1])
+
+    def is_completed(self, resp):
+        if is_terminal_event(resp.event):
             return True
-        elif resp.event in ('AsyncAGIExec',):
+        elif resp.subevent in terminal_subevents:
             return True
-        elif resp.response in ('Success', 'Error', 'Fail', 'Failure'):
+        elif resp.response in terminal_responses:
             return True
         elif not self.multi:
             return True
         return False
 
     def add_message(self, message):
+        self.received += 1
+        if self.overflowed:
+            # drop the remaining responses but wait for the end of the list
+            return self.is_completed(message)
         self.responses.append(message)
+        self.wakeup()
         multi = self.multi
         if self.completed and not self.done():
-            if multi and len(self.responses) > 1:
+            if self.stream and (not multi or self.received > 1):
+                # only keep the completion event
+                self.set_result(message)
+            elif multi and len(self.responses) > 1:
                 self.set_result(self.responses)
             elif not multi:
                 self.set_result(self.responses[0])
             else:
                 return False
             return True
+        retained = len(self.responses)
+        if self.stream:
+            retained -= self.responses_index
+        if self.max_responses and retained > self.max_responses:
+            self.overflowed = True
+            self.responses = []
+            self.responses_index = 0
+            if not self.done():
+                self.set_exception(TooManyResponses(
+                    'More than %s responses retained for %s' % (
+                        self.max_responses, self['action'])))
+            return False
 
 
 class Command(Action):
@@ -127,9 +202,9 @@ class Command(Action):
         >>> command = Command({'Command' : 'Do something'})
         >>> print(command) # doctest: +NORMALIZE_WHITESPACE
         Action: Command
-        ActionID: action/myuuid/1/1
+        ActionID: action/myuuid/1
         Command: Do something
-        CommandID: command/myuuid/1/1
+        CommandID: command/myuuid/1
     """
 
     command_id_generator = utils.IdGenerator('command')
@@ -148,3 +223,119 @@ class Command(Action):
     @property
     def action_id(self):
         return self.actionid or None
+
+
+class AwaitingActions:
+    """Actions waiting for a new connection to be sent again.
+
+    Actions with the lowest ``replay_priority`` are sent first. Actions
+    are cancelled when they have been waiting more than their
+    ``replay_ttl`` (or ``ttl``) seconds or when they are evicted because
+    the queue is full. ``eviction`` can be ``oldest``, ``newest`` or
+    ``priority`` (the oldest of the lowest priority actions):
+
+    .. code-block:: python
+
+        >>> queue = AwaitingActions(maxsize=2, eviction='priority')
+        >>> queue.append(Action({'Action': 'Setvar'}, replay_priority=5))
+        >>> queue.append(Action({'Action': 'Originate'}))
+        >>> queue.append(Action({'Action': 'Hangup'}, replay_priority=1))
+        >>> print(queue.popleft()['Action'])
+        Originate
+        >>> len(queue), queue.dropped
+        (1, 1)
+    """
+
+    def __init__(self, maxsize=None, ttl=None, eviction='oldest'):
+        if eviction not in ('oldest', 'newest', 'priority'):
+            raise ValueError('Invalid eviction policy: %r' % eviction)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.eviction = eviction
+        # entries are [priority, counter, deadline, action]. The action is
+        # replaced by None when the entry is removed and removed entries are
+        # skipped (or compacted) lazily so eviction is not O(n)
+        self.heap = []
+        # insertion order, used to evict the oldest action
+        self.order = collections.deque()
+        # (-priority, counter, entry), used to evict by priority
+        self.victims = []
+        self.size = 0
+        self.counter = itertools.count()
+        self.dropped = 0
+        self.expired = 0
+
+    def append(self, action):
+        ttl = action.replay_ttl if action.replay_ttl is not None else self.ttl
+        deadline = time.monotonic() + ttl if ttl is not None else None
+        counter = next(self.counter)
+        entry = [action.replay_priority, counter, deadline, action]
+        if self.maxsize and self.size >= self.maxsize:
+            if self.eviction == 'newest':
+                self.dropped += 1
+                action.cancel()
+                return
+            self.push(entry)
+            if self.eviction == 'oldest':
+                evicted = self.order.popleft()
+                while evicted[-1] is None:
+                    evicted = self.order.popleft()
+            else:
+                evicted = heapq.heappop(self.victims)[-1]
+                while evicted[-1] is None:
+                    evicted = heapq.heappop(self.victims)[-1]
+            self.dropped += 1
+            self.remove(evicted).cancel()
+        else:
+            self.push(entry)
+        self.compact()
+
+    def push(self, entry):
+        heapq.heappush(self.heap, entry)
+        if self.maxsize:
+            if self.eviction == 'oldest':
+                self.order.append(entry)
+            elif self.eviction == 'priority':
+                heapq.heappush(self.victims, (-entry[0], entry[1], entry))
+        self.size += 1
+
+    def remove(self, entry):
+        action = entry[-1]
+        entry[-1] = None
+        self.size -= 1
+        return action
+
+    def compact(self):
+        """Forget removed entries when they outnumber the queued ones"""
+        stale = max(len(self.heap), len(self.order), len(self.victims))
+        if stale <= 2 * self.size + 32:
+            return
+        self.heap = [e for e in self.heap if e[-1] is not None]
+        heapq.heapify(self.heap)
+        self.order = collections.deque(
+            e for e in self.order if e[-1] is not None)
+        self.victims = [v for v in self.victims if v[-1][-1] is not None]
+        heapq.heapify(self.victims)
+
+    def popleft(self):
+        """Return the next action to send. Expired actions are cancelled and
+        skipped. Raise IndexError if there is no action"""
+        now = time.monotonic()
+        while True:
+            entry = heapq.heappop(self.heap)
+            if entry[-1] is None:
+                continue
+            deadline = entry[2]
+            action = self.remove(entry)
+            self.compact()
+            if deadline is not None and deadline < now:
+                self.expired += 1
+                action.cancel()
+                continue
+            return action
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (e[-1] for e in sorted(self.heap) if e[-1] is not None)
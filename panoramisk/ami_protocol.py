@@ -1,6 +1,8 @@
 import logging
 import asyncio
-from collections import deque
+import heapq
+import itertools
+import time
 
 from .message import Message
 from . import actions
@@ -12,13 +14,24 @@ class AMIProtocol(asyncio.Protocol):
     def connection_made(self, transport):
         self.transport = transport
         self.closed = False
-        self.queue = deque()
+        self.buffer = bytearray()
+        self.scanned = 0
         self.responses = {}
         self.factory = None
         self.version = None
         self.log = logging.getLogger(__name__)
+        self.loop = None
+        self.outgoing = []
+        self.flusher = None
+        self.paused = False
+        self.drain_waiters = []
+        self.metrics = None
+        self.recorder = None
+        self.timeouts = []
+        self.timeouts_counter = itertools.count()
+        self.timer = None
 
-    def send(self, data, as_list=False):
+    def send(self, data, as_list=False, stream=None, response_timeout=None):
         encoding = getattr(self, 'encoding', 'ascii')
         if not isinstance(data, actions.Action):
             if 'Command' in data:
@@ -27,67 +40,193 @@ class AMIProtocol(asyncio.Protocol):
                 klass = actions.Action
             data = klass(data, as_list=as_list)
         data.as_list = as_list
+        if stream is not None:
+            data.stream = stream
+        config = getattr(self, 'config', {})
+        if data.max_responses is None:
+            data.max_responses = config.get('max_responses')
+        if response_timeout is None:
+            response_timeout = data.response_timeout
+        if response_timeout is None:
+            response_timeout = config.get('response_timeout')
+        data.response_timeout = response_timeout
         self.responses[data.id] = data
         if data.action_id:
             self.responses[data.action_id] = data
+        data.add_done_callback(self.action_done)
+        if response_timeout:
+            self.add_timeout(data, float(response_timeout))
+        if self.metrics is not None:
+            data.sent_at = time.perf_counter()
+        # actions sent during the same loop iteration are written at once
+        self.outgoing.append(str(data).encode(encoding))
+        if self.flusher is None and not self.paused:
+            loop = self.loop or asyncio.get_event_loop()
+            self.flusher = loop.call_soon(self.flush)
+        return data
+
+    def forget(self, action):
+        """Remove an action from the responses table"""
+        for key in (action.id, action.action_id):
+            if key and self.responses.get(key) is action:
+                del self.responses[key]
+
+    def action_done(self, action):
+        if action.timeout_entry is not None:
+            # do not keep the action and its responses until the deadline
+            action.timeout_entry[-1] = None
+            action.timeout_entry = None
+        if action.cancelled():
+            self.forget(action)
+
+    def add_timeout(self, action, timeout):
+        """Fail the action with a TimeoutError if it is not done after
+        ``timeout`` seconds. All timeouts share the same timer"""
+        loop = self.loop or asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        action.timeout_entry = [deadline, next(self.timeouts_counter), action]
+        heapq.heappush(self.timeouts, action.timeout_entry)
+        if self.timer is None or deadline < self.timer.when():
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = loop.call_at(deadline, self.check_timeouts)
+
+    def check_timeouts(self):
+        self.timer = None
+        loop = self.loop or asyncio.get_event_loop()
+        now = loop.time()
+        timeouts = self.timeouts
+        while timeouts and timeouts[0][0] <= now:
+            action = heapq.heappop(timeouts)[-1]
+            if action is not None and not action.done():
+                self.forget(action)
+                action.set_exception(asyncio.TimeoutError(
+                    'No response for %s' % action.id))
+                if self.metrics is not None:
+                    self.metrics.inc('panoramisk_action_timeouts_total',
+                                     action=action['action'])
+        if timeouts:
+            self.timer = loop.call_at(timeouts[0][0], self.check_timeouts)
+
+    def flush(self):
+        """Write pending actions to the transport"""
+        self.flusher = None
+        if self.paused or self.closed or not self.outgoing:
+            return
+        data = b''.join(self.outgoing)
+        self.outgoing = []
         try:
-            self.transport.write(str(data).encode(encoding))
+            self.transport.write(data)
         except Exception:  # pragma: no cover
             self.log.exception('Fail to send %r' % data)
-        return data
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.flush()
+        waiters, self.drain_waiters = self.drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def drain(self):
+        """Wait until the transport's write buffer is below its low
+        watermark"""
+        if self.paused and not self.closed:
+            loop = self.loop or asyncio.get_event_loop()
+            waiter = loop.create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
 
     def data_received(self, data):
         encoding = getattr(self, 'encoding', 'ascii')
-        data = data.decode(encoding, 'ignore')
+        if self.recorder is not None:
+            self.recorder.write(data)
         if getattr(self.factory, 'save_stream', None):  # pragma: no cover
             stream = self.factory.save_stream
             if hasattr(stream, 'write'):
-                stream.write(data.encode(encoding))
+                stream.write(data)
             else:
-                with open(stream, 'a+') as fd:
-                    fd.write(data.encode(encoding))
+                with open(stream, 'ab') as fd:
+                    fd.write(data)
         # Very verbose, uncomment only if necessary
         # self.log.debug('data received: "%s"', data)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.inc('panoramisk_bytes_received_total', len(data))
 
         if self.version is None:
-            if data.startswith('Asterisk Call Manager/'):
-                version, __, __ = data.partition(utils.EOL)
-                __, __, version = version.partition('/')
-                self.version = version.strip()
+            if data.startswith(b'Asterisk Call Manager/'):
+                version, __, __ = data.partition(utils.EOL.encode())
+                __, __, version = version.partition(b'/')
+                self.version = version.strip().decode(encoding, 'ignore')
                 self.log.info("protocol version: '%s'", self.version)
 
-        if self.queue:
-            data = self.queue.popleft() + data
-        lines = data.split(utils.EOL+utils.EOL)
-        self.queue.append(lines.pop(-1))
-        for line in lines:
+        for line in self.frames(data, encoding):
             # Because sometimes me receive only one EOL from Asterisk
             line = line.strip()
             # Very verbose, uncomment only if necessary
             # self.log.debug('message received: "%s"', line)
-            message = Message.from_line(line)
+            if metrics is None:
+                message = Message.from_line(line)
+            else:
+                start = time.perf_counter()
+                message = Message.from_line(line)
+                metrics.observe('panoramisk_frame_classify_seconds',
+                                time.perf_counter() - start)
             self.log.debug('message interpreted: %r', message)
             if message is None:
                 continue
             self.handle_message(message)
 
+    def frames(self, data, encoding='ascii'):
+        """Append data to the buffer and return the complete frames.
+
+        Only the bytes received since the last call are scanned for a frame
+        separator so a large frame split in many chunks is not scanned again
+        and again. Complete frames are decoded at once."""
+        separator = utils.EOL + utils.EOL
+        buffer = self.buffer
+        buffer += data
+        pos = max(self.scanned - len(separator) + 1, 0)
+        end = buffer.rfind(separator.encode(), pos)
+        if end == -1:
+            self.scanned = len(buffer)
+            return []
+        end += len(separator)
+        frames = buffer[:end].decode(encoding, 'ignore').split(separator)
+        del buffer[:end]
+        self.scanned = len(buffer)
+        # last item is always empty
+        frames.pop()
+        return frames
+
     def handle_message(self, message):
         response = self.responses.get(message.id)
         if response is None and message.action_id:
             response = self.responses.get(message.action_id)
         if response is not None:
             if response.add_message(message):
+                if self.metrics is not None and response.sent_at:
+                    self.metrics.observe(
+                        'panoramisk_action_seconds',
+                        time.perf_counter() - response.sent_at,
+                        action=response['action'])
                 # completed; dequeue
                 self.responses.pop(response.id)
                 if response.action_id:
                     self.responses.pop(response.action_id, None)
-        elif 'event' in message:
-            if message['event'].lower() == 'shutdown':
+        elif message.event:
+            if message.event.lower() == 'shutdown':
                 self.connection_lost(message)
             self.factory.dispatch(message)
 
     def connection_lost(self, exc):
         if not self.closed:
+            # nothing can be written anymore
+            self.outgoing = []
             self.close()
             self.factory.connection_lost(exc)
 
@@ -98,17 +237,42 @@ class AMIProtocol(asyncio.Protocol):
             awaiting_actions = self.factory.awaiting_actions
             for k in list(self.responses.keys()):
                 action = self.responses.pop(k)
-                uuids.add(action.id)
-                if action['action'].lower() in forgetable_actions:
-                    continue
-                elif action.done():  # pragma: no cover
+                if action.id in uuids:
+                    # commands are also stored by their ActionID
                     continue
-                elif action.responses:
-                    # If at least one response was receive from asterisk we don't queue it again
+                uuids.add(action.id)
+                if action.done():  # pragma: no cover
                     continue
+                elif (action['action'].lower() in forgetable_actions or
+                        action.received):
+                    # If at least one response was receive from asterisk we don't queue it again.
+                    # Fail it instead of leaving it pending forever
+                    action.set_exception(ConnectionError(
+                        'Connection closed before %s got a response' % (
+                            action.id)))
                 else:
                     self.log.info('Adding action "%s" to awaiting list: %s', action['action'].lower(), str(action))
                     awaiting_actions.append(action)
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.timeouts = []
+        if not self.closed and self.outgoing:
+            # write what was sent in the same loop iteration (eg. Logoff).
+            # The transport still writes its buffer before closing
+            data, self.outgoing = b''.join(self.outgoing), []
+            try:
+                self.transport.write(data)
+            except Exception:  # pragma: no cover
+                self.log.exception('Fail to send %r' % data)
+        self.outgoing = []
+        waiters, self.drain_waiters = self.drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
         if not self.closed:
             try:
                 self.transport.close()
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from collections import OrderedDict
+from .manager import Manager
+
+
+class Cluster:
+    """Handle many Asterisk servers on the same event loop:
+
+    .. code-block:: python
+
+        >>> cluster = Cluster(username='username', secret='mysecret')
+        >>> cluster.add_node('pbx1', host='10.0.0.1')
+        <panoramisk.manager.Manager object at 0x...>
+        >>> cluster.add_node('pbx2', host='10.0.0.2')
+        <panoramisk.manager.Manager object at 0x...>
+
+    Keyword arguments are the configuration shared by all the nodes. Each
+    node's :class:`~panoramisk.Manager` has a ``node`` attribute with its
+    name so callbacks know where an event comes from with
+    ``event.manager.node``. The ``record`` setting is not shared: pass it
+    to :meth:`add_node` to record a node.
+    """
+
+    def __init__(self, loop=None, manager_factory=Manager, **config):
+        self.loop = loop
+        self.manager_factory = manager_factory
+        self.config = config
+        self.managers = OrderedDict()
+        self.health = OrderedDict()
+        self.callbacks = []
+
+    def add_node(self, name, **config):
+        """Add a node to the cluster. Return its manager"""
+        if name in self.managers:
+            raise ValueError('A node named %r already exists.' % name)
+        # a recording can not be shared by several nodes
+        config = dict(dict(self.config, record=None), **config)
+        config['metrics_labels'] = dict(config.get('metrics_labels') or {},
+                                        node=name)
+        hooks = {}
+        for hook in ('on_connect', 'on_login', 'on_disconnect'):
+            if hook in config:
+                hooks[hook] = config.pop(hook)
+        manager = self.manager_factory(
+            loop=self.loop,
+            on_connect=self.on_connect,
+            on_login=self.on_login,
+            on_disconnect=self.on_disconnect,
+            **config)
+        manager.node = name
+        manager.node_hooks = hooks
+        for pattern, callback, kwargs in self.callbacks:
+            manager.register_event(pattern, callback, **kwargs)
+        self.managers[name] = manager
+        self.health[name] = dict(
+            state='disconnected', connections=0, reconnects=0,
+            connected_at=None, disconnected_at=None, error=None)
+        return manager
+
+    def del_node(self, name):
+        """Close a node's connection and remove it from the cluster"""
+        if name not in self.managers:
+            raise ValueError('This node doesn\'t exist.')
+        self.managers.pop(name).close()
+        self.health.pop(name)
+
+    def on_connect(self, manager):
+        health = self.health.get(manager.node)
+        if health is not None:
+            if health['connections']:
+                health['reconnects'] += 1
+            health['connections'] += 1
+            health['state'] = 'connected'
+            health['connected_at'] = time.time()
+            health['error'] = None
+        manager.node_hooks.get('on_connect', lambda m: None)(manager)
+
+    def on_login(self, manager):
+        health = self.health.get(manager.node)
+        if health is not None:
+            health['state'] = 'authenticated'
+        manager.node_hooks.get('on_login', lambda m: None)(manager)
+
+    def on_disconnect(self, manager, exc):
+        health = self.health.get(manager.node)
+        if health is not None:
+            health['state'] = 'disconnected'
+            health['disconnected_at'] = time.time()
+            health['error'] = exc
+        manager.node_hooks.get('on_disconnect', lambda m, e: None)(
+            manager, exc)
+
+    def is_available(self, name):
+        """Return True if the node is able to send actions"""
+        protocol = self.managers[name].protocol
+        return protocol is not None and not protocol.closed
+
+    def register_event(self, pattern, callback=None, **kwargs):
+        """Register an event on all the nodes, including nodes added later.
+        See :meth:`~panoramisk.Manager.register_event`"""
+        def _register_event(callback):
+            self.callbacks.append((pattern, callback, kwargs))
+            for manager in self.managers.values():
+                manager.register_event(pattern, callback, **kwargs)
+            return callback
+        if callback is not None:
+            return _register_event(callback)
+        else:
+            return _register_event
+
+    def send_action(self, action, node, as_list=None, **kwargs):
+        """Send an action to a node.
+        See :meth:`~panoramisk.Manager.send_action`"""
+        return self.managers[node].send_action(
+            action, as_list=as_list, **kwargs)
+
+    async def broadcast(self, action, nodes=None, as_list=None, timeout=None,
+                        **kwargs):
+        """Send an action to all the available nodes (or to ``nodes``) and
+        gather the results in a dict using node names as keys. A failed or
+        timed out action gives the exception as result::
+
+            cluster = Cluster()
+            results = await cluster.broadcast({'Action': 'CoreShowChannels'})
+            for node, channels in results.items():
+                print(node, channels)
+        """
+        if nodes is None:
+            nodes = list(self.managers)
+        futures = OrderedDict()
+        for name in nodes:
+            if self.is_available(name):
+                futures[name] = asyncio.wait_for(
+                    self.send_action(dict(action), name, as_list=as_list,
+                                     **kwargs),
+                    timeout)
+        results = await asyncio.gather(*futures.values(),
+                                       return_exceptions=True)
+        return OrderedDict(zip(futures, results))
+
+    def connect(self):
+        """Connect all the nodes. Return a future done when all of them are
+        connected"""
+        if self.loop is None:  # pragma: no cover
+            self.loop = asyncio.get_event_loop()
+        tasks = []
+        for manager in self.managers.values():
+            manager.loop = self.loop
+            tasks.append(manager.connect())
+        return asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Close all the connections"""
+        for manager in self.managers.values():
+            manager.close()
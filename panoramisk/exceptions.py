@@ -1,3 +1,9 @@
+class TooManyResponses(Exception):
+    """Indicates that an action retained more than ``max_responses``
+    responses.
+    """
+
+
 class AGIException(Exception):
     """The base exception for all AGI-related exceptions.
     """
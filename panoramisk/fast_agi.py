@@ -1,6 +1,11 @@
 import logging
 import asyncio
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
 from collections import OrderedDict
+from collections import defaultdict
 from .exceptions import AGIException, AGIUsageError
 from .utils import parse_agi_result
 
@@ -8,12 +13,17 @@ log = logging.getLogger(__name__)
 
 
 class Request:
-    def __init__(self, app, headers, reader, writer, encoding='utf-8'):
+    def __init__(self, app, headers, reader, writer, encoding='utf-8',
+                 params=None):
         self.app = app
         self.headers = headers
+        self.params = params if params is not None else {}
         self.reader = reader
         self.writer = writer
         self.encoding = encoding
+        self.pending = 0
+        self.results = []
+        self.command_timeout = app.command_timeout
 
     async def send_command(self, command):
         """Send a command for FastAGI request:
@@ -32,27 +42,94 @@ class Request:
                 await request.send_command('EXEC Wait 10')
 
         """
-        command += '\n'
-        self.writer.write(command.encode(self.encoding))
+        results = await self.send_commands([command])
+        return results[0]
+
+    async def send_commands(self, commands, wait=True):
+        """Send many commands at once and return their results in the same
+        order. Only one round trip is needed:
+
+        :param commands: Commands to launch. Ex: ['ANSWER', 'SET VARIABLE X 1']
+        :type commands: list
+
+        A result not received after the application's ``command_timeout``
+        raises an :class:`asyncio.TimeoutError`.
+
+        With ``wait=False`` commands are written without waiting for the
+        connection to be drained nor for their results. Results are read
+        before the results of the next commands and returned by
+        :meth:`collect`. Errors are not raised for those commands, the
+        result has an ``error`` key instead.
+
+        :Example:
+
+        ::
+
+            async def call_waiting(request):
+                await request.send_commands([
+                    'SET VARIABLE LANGUAGE() fr',
+                    'SET VARIABLE CHANNEL(musicclass) default',
+                ], wait=False)
+                results = await request.send_commands([
+                    'ANSWER', 'EXEC StartMusicOnHold'])
+
+        """
+        data = ''.join(command + '\n' for command in commands)
+        self.writer.write(data.encode(self.encoding))
+        if not wait:
+            self.pending += len(commands)
+            return None
         await self.writer.drain()
+        await self.read_pending()
 
+        results = []
+        error = None
+        for command in commands:
+            # read all the results before raising so the next command does
+            # not get the result of a previous one
+            try:
+                results.append(await self.read_result())
+            except AGIException as err:
+                if error is None:
+                    error = err
+                results.append(err.items)
+        if error is not None:
+            raise error
+        return results
+
+    async def read_pending(self):
+        while self.pending:
+            self.pending -= 1
+            self.results.append(await self.read_result(raise_on_error=False))
+
+    async def collect(self):
+        """Return the results of the commands sent with ``wait=False``"""
+        await self.read_pending()
+        results, self.results = self.results, []
+        return results
+
+    async def read_result(self, raise_on_error=None):
+        """Read the result of a command"""
+        if raise_on_error is None:
+            raise_on_error = self.app.raise_on_error
         try:
-            agi_result = await self._read_result()
-            # If Asterisk returns `100 Trying...`, wait for next the response.
-            while agi_result.get('status_code') == 100:
-                agi_result = await self._read_result()
+            if self.command_timeout:
+                agi_result = await asyncio.wait_for(
+                    self.read_final_result(), self.command_timeout)
+            else:
+                agi_result = await self.read_final_result()
         except AGIUsageError as err:
             message = err.args[0]
             # When we get AGIUsageError the following line contains some indication
             buff_usage_error = await self.reader.readline()
             message += buff_usage_error.decode(self.encoding)
-            if self.app.raise_on_error:
+            if raise_on_error:
                 raise AGIUsageError(message, err.items)
             agi_result = err.items
             agi_result['error'] = err.__class__.__name__
             agi_result['msg'] = message
         except AGIException as err:
-            if self.app.raise_on_error:
+            if raise_on_error:
                 raise
             agi_result = err.items
             agi_result['error'] = err.__class__.__name__
@@ -60,6 +137,13 @@ class Request:
 
         return agi_result
 
+    async def read_final_result(self):
+        agi_result = await self._read_result()
+        # If Asterisk returns `100 Trying...`, wait for next the response.
+        while agi_result.get('status_code') == 100:
+            agi_result = await self._read_result()
+        return agi_result
+
     async def _read_result(self):
         """Read a response from the AGI and parse it.
 
@@ -69,18 +153,160 @@ class Request:
         return parse_agi_result(response.decode(self.encoding)[:-1])
 
 
+class RouteNode:
+
+    __slots__ = ('children', 'params', 'template')
+
+    def __init__(self):
+        self.children = {}
+        self.params = []
+        self.template = None
+
+
+class Router:
+    """Match AGI scripts with path templates. A template's segments can be
+    parameters: ``{name}`` matches a segment, ``{name:int}`` a number and
+    ``{name:path}`` the rest of the path:
+
+    .. code-block:: python
+
+        >>> router = Router()
+        >>> router.add('tenant/{tenant:int}/ivr/{menu}')
+        >>> router.add('tenant/{tenant:int}/record/{file:path}')
+        >>> router.match('tenant/42/ivr/main')
+        ('tenant/{tenant:int}/ivr/{menu}', {'menu': 'main', 'tenant': 42})
+        >>> router.match('tenant/42/record/2024/01/call.wav')[1]
+        {'file': '2024/01/call.wav', 'tenant': 42}
+        >>> print(router.match('tenant/main/ivr/main'))
+        None
+
+    Templates are stored in a tree of segments so a lookup only depends on
+    the path's length. Static segments are tried before parameters.
+    """
+
+    types = ('str', 'int', 'path')
+
+    def __init__(self):
+        self.root = RouteNode()
+        self.templates = set()
+
+    def __len__(self):
+        return len(self.templates)
+
+    def add(self, template):
+        if template in self.templates:
+            raise ValueError('A route already exists.')
+        node = self.root
+        segments = template.split('/')
+        for i, segment in enumerate(segments):
+            if segment.startswith('{') and segment.endswith('}'):
+                name, __, kind = segment[1:-1].partition(':')
+                kind = kind or 'str'
+                if kind not in self.types:
+                    raise ValueError('Invalid parameter type: %r' % kind)
+                if kind == 'path' and i != len(segments) - 1:
+                    raise ValueError('A path parameter must be the last '
+                                     'segment of %r' % template)
+                for param in node.params:
+                    if param[:2] == (name, kind):
+                        node = param[2]
+                        break
+                else:
+                    child = RouteNode()
+                    node.params.append((name, kind, child))
+                    node = child
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+        node.template = template
+        self.templates.add(template)
+
+    def remove(self, template):
+        self.templates.remove(template)
+        node = self.root
+        for segment in template.split('/'):
+            if segment.startswith('{') and segment.endswith('}'):
+                name, __, kind = segment[1:-1].partition(':')
+                kind = kind or 'str'
+                for param in node.params:
+                    if param[:2] == (name, kind):
+                        node = param[2]
+                        break
+            else:
+                node = node.children[segment]
+        node.template = None
+
+    def match(self, path):
+        """Return the template matching a path and its parameters or None"""
+        params = {}
+        template = self.lookup(self.root, path.split('/'), 0, params)
+        if template is None:
+            return None
+        return template, params
+
+    def lookup(self, node, segments, index, params):
+        if index == len(segments):
+            return node.template
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            template = self.lookup(child, segments, index + 1, params)
+            if template is not None:
+                return template
+        for name, kind, child in node.params:
+            if kind == 'path':
+                if child.template is not None:
+                    params[name] = '/'.join(segments[index:])
+                    return child.template
+                continue
+            elif kind == 'int':
+                # str.isdigit() accepts digits int() rejects (eg. '²')
+                if not (segment.isascii() and segment.isdigit()):
+                    continue
+                value = int(segment)
+            elif not segment:
+                continue
+            else:
+                value = segment
+            template = self.lookup(child, segments, index + 1, params)
+            if template is not None:
+                params[name] = value
+                return template
+        return None
+
+
 class Application(dict):
     """Main object:
 
     .. code-block:: python
 
         >>> fa_app = Application()
+
+    AGI headers bigger than ``headers_limit`` bytes are rejected. The
+    StreamReader's own limit (64KB by default, see the ``limit`` argument of
+    :func:`asyncio.start_server`) also applies.
+
+    Limits and timeouts are disabled by default:
+
+    - ``max_requests``: requests running at the same time. Routes can have
+      their own limit, see :meth:`add_route`
+    - ``headers_timeout``: seconds to receive the AGI headers
+    - ``command_timeout``: seconds to receive the result of a command
+    - ``request_timeout``: seconds before a request is cancelled
+
+    Routes can be templates with parameters (see :class:`Router`). Exact
+    routes are tried first.
+
+    When a limit is reached, the request is answered by the
+    ``overload_route`` route if any, otherwise the channel is hung up.
+    ``rejected`` counts those requests.
     """
 
-    buf_size = 100
+    headers_limit = 16 * 1024
 
     def __init__(
-            self, default_encoding='utf-8', loop=None, raise_on_error=False, decode_errors='strict'
+            self, default_encoding='utf-8', loop=None, raise_on_error=False, decode_errors='strict',
+            max_requests=None, headers_timeout=None, command_timeout=None,
+            request_timeout=None, overload_route=None,
     ):
         super(Application, self).__init__()
         self.default_encoding = default_encoding
@@ -92,15 +318,28 @@ class Application(dict):
                 loop = asyncio.get_event_loop()
         self.loop = loop
         self.raise_on_error = raise_on_error
+        self.max_requests = max_requests
+        self.headers_timeout = headers_timeout
+        self.command_timeout = command_timeout
+        self.request_timeout = request_timeout
+        self.overload_route = overload_route
+        self.active = 0
+        self.rejected = 0
         self._route = OrderedDict()
+        self.router = Router()
+        self._route_limits = {}
+        self._route_active = defaultdict(int)
 
-    def add_route(self, path, endpoint):
+    def add_route(self, path, endpoint, max_requests=None):
         """Add a route for FastAGI requests:
 
         :param path: URI to answer. Ex: 'calls/start'
         :type path: String
         :param endpoint: command to launch. Ex: start
         :type endpoint: callable
+        :param max_requests: maximum requests running at the same time for
+                             this route
+        :type max_requests: int
 
         :Example:
 
@@ -113,13 +352,24 @@ class Application(dict):
             fa_app = Application()
             fa_app.add_route('calls/start', start)
 
+        The path can be a template. Parameters are found in
+        ``request.params``::
+
+            async def ivr(request):
+                print(request.params['tenant'], request.params['menu'])
+
+            fa_app.add_route('tenant/{tenant:int}/ivr/{menu}', ivr)
+
         """
         assert callable(endpoint), endpoint
         if path in self._route:
             raise ValueError('A route already exists.')
         if not asyncio.iscoroutinefunction(endpoint):
             endpoint = asyncio.coroutine(endpoint)
+        if '{' in path:
+            self.router.add(path)
         self._route[path] = endpoint
+        self._route_limits[path] = max_requests
 
     def del_route(self, path):
         """Delete a route for FastAGI requests:
@@ -142,7 +392,42 @@ class Application(dict):
         """
         if path not in self._route:
             raise ValueError('This route doesn\'t exist.')
+        if path in self.router.templates:
+            self.router.remove(path)
         del self._route[path]
+        del self._route_limits[path]
+
+    async def read_headers(self, reader, writer):
+        """Read the AGI headers. Return None if they are incomplete or too
+        big"""
+        try:
+            if self.headers_timeout:
+                buffer = await asyncio.wait_for(reader.readuntil(b'\n\n'),
+                                                self.headers_timeout)
+            else:
+                buffer = await reader.readuntil(b'\n\n')
+        except asyncio.TimeoutError:
+            log.error('AGI headers from %r not received after %ss',
+                      writer.get_extra_info('peername'), self.headers_timeout)
+            return None
+        except asyncio.IncompleteReadError:
+            log.error('Connection from %r closed before the end of AGI '
+                      'headers', writer.get_extra_info('peername'))
+            return None
+        except asyncio.LimitOverrunError:
+            buffer = None
+        if buffer is None or len(buffer) > self.headers_limit:
+            log.error('AGI headers from %r are too big',
+                      writer.get_extra_info('peername'))
+            return None
+        headers = OrderedDict()
+        # decode once. Lines without a value are ignored
+        for line in buffer[:-2].decode(
+                self.default_encoding, errors=self.decode_errors).split('\n'):
+            key, sep, value = line.partition(': ')
+            if sep:
+                headers[key] = value
+        return headers
 
     async def handler(self, reader, writer):
         """AsyncIO coroutine handler to launch socket listening.
@@ -162,13 +447,10 @@ class Application(dict):
 
         See https://docs.python.org/3/library/asyncio-stream.html
         """
-        buffer = b''
-        while b'\n\n' not in buffer:
-            buffer += await reader.read(self.buf_size)
-        lines = buffer[:-2].decode(self.default_encoding, errors=self.decode_errors).split('\n')
-        headers = OrderedDict([
-            line.split(': ', 1) for line in lines if ': ' in line
-        ])
+        headers = await self.read_headers(reader, writer)
+        if headers is None:
+            writer.close()
+            return
 
         agi_network_script = headers.get('agi_network_script')
         log.info('Received FastAGI request from %r for "%s" route',
@@ -176,22 +458,208 @@ class Application(dict):
         log.debug("Asterisk Headers: %r", headers)
 
         if agi_network_script is not None:
-            route = self._route.get(agi_network_script)
+            path = agi_network_script
+            params = None
+            route = self._route.get(path)
+            if route is None and self.router:
+                match = self.router.match(path)
+                if match is not None:
+                    path, params = match
+                    route = self._route[path]
             if route is not None:
                 request = Request(app=self,
                                   headers=headers,
                                   reader=reader, writer=writer,
-                                  encoding=self.default_encoding)
-                try:
-                    await route(request)
-                except BaseException:
-                    log.exception(
-                        'An exception has been raised for the request "%s"',
-                        agi_network_script
-                    )
+                                  encoding=self.default_encoding,
+                                  params=params)
+                if self.overloaded(path):
+                    await self.reject(request, path)
+                else:
+                    await self.run_route(route, request, path)
             else:
                 log.error('No route for the request "%s"', agi_network_script)
         else:
             log.error('No agi_network_script header for the request')
         log.debug("Closing client socket")
         writer.close()
+
+    def overloaded(self, path):
+        """Return True if a new request for this route exceeds a limit"""
+        if self.max_requests and self.active >= self.max_requests:
+            return True
+        limit = self._route_limits.get(path)
+        return bool(limit) and self._route_active[path] >= limit
+
+    async def run_route(self, route, request, path):
+        self.active += 1
+        self._route_active[path] += 1
+        try:
+            if self.request_timeout:
+                await asyncio.wait_for(route(request), self.request_timeout)
+            else:
+                await route(request)
+        except asyncio.TimeoutError:
+            log.error('The request "%s" timed out', path)
+        except BaseException:
+            log.exception(
+                'An exception has been raised for the request "%s"', path
+            )
+        finally:
+            self.active -= 1
+            self._route_active[path] -= 1
+
+    async def reject(self, request, path):
+        """Answer a request when the application is overloaded"""
+        self.rejected += 1
+        log.warning('Too many requests. Rejecting a request for "%s"', path)
+        route = self._route.get(self.overload_route)
+        if route is not None:
+            try:
+                await route(request)
+            except BaseException:
+                log.exception('An exception has been raised for the '
+                              'overload route "%s"', self.overload_route)
+        else:
+            request.writer.write(b'HANGUP\n')
+
+    def bind(self, host, port, backlog=100):
+        """Return a listening socket shared by forked workers"""
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+        return sock
+
+    def serve(self, host='0.0.0.0', port=4573, workers=1, reuse_port=None,
+              shutdown_timeout=10.):
+        """Run a FastAGI server until SIGTERM or SIGINT is received:
+
+        .. code-block:: python
+
+            fa_app = Application()
+            fa_app.add_route('calls/start', start)
+            fa_app.serve('0.0.0.0', 4573, workers=4)
+
+        With more than one worker, each worker is a forked process running
+        its own event loop. Workers listen on their own socket bound with
+        ``SO_REUSEPORT`` when the platform supports it (or ``reuse_port`` is
+        True), on a socket bound before forking otherwise. Dead workers are
+        replaced.
+
+        On SIGTERM or SIGINT, workers stop accepting connections and wait
+        ``shutdown_timeout`` seconds for the running requests before
+        cancelling them. On SIGHUP, the server starts new workers then
+        gracefully stops the old ones. New workers are forked from the main
+        process so Python code is not reloaded.
+        """
+        if reuse_port is None:
+            reuse_port = workers > 1 and hasattr(socket, 'SO_REUSEPORT')
+        config = dict(host=host, port=port, sock=None, reuse_port=reuse_port,
+                      shutdown_timeout=shutdown_timeout)
+        if not reuse_port:
+            config['sock'] = self.bind(host, port)
+        try:
+            if workers <= 1:
+                self.run_worker(**config)
+            else:
+                self.run_workers(workers, config)
+        finally:
+            if config['sock'] is not None:
+                config['sock'].close()
+
+    def run_workers(self, workers, config):
+        context = multiprocessing.get_context('fork')
+
+        def worker():
+            # the main process handles reloads
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            self.run_worker(**config)
+
+        def spawn():
+            process = context.Process(target=worker, daemon=True)
+            process.start()
+            return process
+
+        received = []
+
+        def on_signal(signum, frame):
+            received.append(signum)
+
+        handlers = {}
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            handlers[signum] = signal.signal(signum, on_signal)
+        processes = [spawn() for i in range(workers)]
+        stopping = []
+        try:
+            while True:
+                while received:
+                    signum = received.pop(0)
+                    if signum != signal.SIGHUP:
+                        return
+                    log.info('Reloading %d FastAGI workers', workers)
+                    old, processes = processes, [
+                        spawn() for i in range(workers)]
+                    for process in old:
+                        process.terminate()
+                    stopping.extend(old)
+                stopping = [p for p in stopping if p.is_alive()]
+                for i, process in enumerate(processes):
+                    if not process.is_alive():
+                        log.error('FastAGI worker %s exited with code %s',
+                                  process.pid, process.exitcode)
+                        processes[i] = spawn()
+                multiprocessing.connection.wait(
+                    [p.sentinel for p in processes], timeout=.5)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes + stopping:
+                process.join(config['shutdown_timeout'] + 1)
+                if process.is_alive():  # pragma: no cover
+                    process.kill()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def run_worker(self, host, port, sock=None, reuse_port=False,
+                   shutdown_timeout=10.):
+        """Serve requests with a new event loop until SIGTERM or SIGINT"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        tasks = set()
+
+        def connected(reader, writer):
+            task = loop.create_task(self.handler(reader, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if sock is not None:
+            coro = asyncio.start_server(connected, sock=sock)
+        else:
+            coro = asyncio.start_server(connected, host, port,
+                                        reuse_port=reuse_port)
+        server = loop.run_until_complete(coro)
+        stopped = loop.create_future()
+
+        def stop():
+            if not stopped.done():
+                stopped.set_result(None)
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop)
+        try:
+            loop.run_until_complete(stopped)
+            server.close()
+            if tasks:
+                log.info('Waiting for %d FastAGI requests', len(tasks))
+                done, pending = loop.run_until_complete(
+                    asyncio.wait(list(tasks), timeout=shutdown_timeout))
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    loop.run_until_complete(asyncio.wait(pending))
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            loop.close()
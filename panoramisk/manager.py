@@ -2,10 +2,13 @@ import asyncio
 import hashlib
 import logging
 from collections import defaultdict
-from collections import deque
 import re
+import time
 import fnmatch
 from .ami_protocol import AMIProtocol
+from .metrics import callback_name
+from .subscription import Subscription
+from .recording import Recorder
 from . import actions
 from . import utils
 
@@ -31,10 +34,29 @@ class Manager:
         ping_delay=10,
         ping_interval=10,
         reconnect_timeout=2,
+        write_buffer_high=64 * 1024,
+        write_buffer_low=16 * 1024,
         protocol_factory=AMIProtocol,
         save_stream=None,
         loop=None,
-        forgetable_actions=('ping', 'login'),
+        forgetable_actions=('ping', 'login', 'filter'),
+        awaiting_actions_maxsize=10000,
+        awaiting_actions_ttl=None,
+        awaiting_actions_eviction='oldest',
+        awaiting_actions_rate=None,
+        events_filter=False,
+        required_events=('FullyBooted', 'Shutdown',
+                         'OriginateResponse', 'AsyncAGI*'),
+        metrics=None,
+        metrics_labels=None,
+        slow_callback_duration=.5,
+        callback_concurrency=10,
+        callback_backlog=1000,
+        executor=None,
+        record=None,
+        max_responses=None,
+        response_timeout=None,
+        stale_action_delay=60,
     )
 
     def __init__(self, **config):
@@ -44,11 +66,57 @@ class Manager:
         self.callbacks = defaultdict(list)
         self.protocol = None
         self.patterns = []
+        self.exact_patterns = defaultdict(list)
+        self.prefix_patterns = defaultdict(list)
+        self.wildcard_patterns = []
+        self.matches_cache = {}
         self.save_stream = self.config.get('save_stream')
         self.authenticated = False
         self.authenticated_future = None
-        self.awaiting_actions = deque()
+        self.awaiting_actions = actions.AwaitingActions(
+            maxsize=int(self.config['awaiting_actions_maxsize'] or 0),
+            ttl=optional_float(self.config['awaiting_actions_ttl']),
+            eviction=self.config['awaiting_actions_eviction'])
+        self.awaiting_actions_rate = optional_float(
+            self.config['awaiting_actions_rate'])
+        self.draining = False
+        self.metrics = self.config['metrics']
+        self.slow_callback_duration = optional_float(
+            self.config['slow_callback_duration'])
+        self.callback_concurrency = int(self.config['callback_concurrency'])
+        self.callback_backlog = int(self.config['callback_backlog'])
+        self.executor = self.config['executor']
+        self.callback_modes = {}
+        # pattern: (queue, workers) for callbacks run in tasks
+        self.task_queues = {}
+        self.tasks = set()
+        self.subscriptions = []
+        self.recorder = self.config['record']
+        # a recorder created from a path is closed with the manager
+        self.own_recorder = isinstance(self.recorder, str)
+        if self.own_recorder:
+            self.recorder = Recorder(self.recorder)
+        if self.metrics is not None:
+            # labels tell apart the gauges of managers sharing the registry
+            labels = self.config['metrics_labels'] or {}
+            awaiting = self.awaiting_actions
+            self.metrics.gauge('panoramisk_awaiting_actions',
+                               lambda: len(awaiting), **labels)
+            self.metrics.gauge('panoramisk_awaiting_actions_dropped',
+                               lambda: awaiting.dropped, **labels)
+            self.metrics.gauge('panoramisk_awaiting_actions_expired',
+                               lambda: awaiting.expired, **labels)
+            self.metrics.gauge('panoramisk_pending_actions',
+                               lambda: len(getattr(self.protocol,
+                                                   'responses', ())),
+                               **labels)
+            self.metrics.gauge('panoramisk_stale_actions',
+                               self.stale_actions, **labels)
         self.forgetable_actions = self.config['forgetable_actions']
+        self.events_filter = self.config['events_filter'] in (
+            True, 'true', 'on', 'yes', '1')
+        self.required_events = self.config['required_events']
+        self.filters = set()
         self.pinger = None
         self.ping_delay = int(self.config['ping_delay'])
         self.ping_interval = int(self.config['ping_interval'])
@@ -72,28 +140,36 @@ class Manager:
                 self._connected = False
             else:
                 self.log.warning('Not able to reconnect')
-            self.loop.call_later(self.reconnect_timeout, self.connect)
+            self.loop.call_later(self.reconnect_timeout, self.reconnect)
         else:
             self._connected = True
             self.log.debug('Manager connected')
             self.loop.call_soon(self.on_connect, self)
             self.protocol = protocol
-            self.protocol.queue = deque()
+            self.protocol.loop = self.loop
+            transport.set_write_buffer_limits(
+                high=int(self.config['write_buffer_high']),
+                low=int(self.config['write_buffer_low']))
+            self.protocol.buffer = bytearray()
+            self.protocol.scanned = 0
             self.protocol.factory = self
             self.protocol.log = self.log
             self.protocol.config = self.config
             self.protocol.encoding = self.encoding = self.config['encoding']
+            self.protocol.metrics = self.metrics
+            self.protocol.recorder = self.recorder
             self.responses = self.protocol.responses = {}
+            self.filters = set()
             if 'username' in self.config:
                 if self.auth_type is not None:
                     if self.auth_type.lower() == 'md5':
-                        self.auth_challenge_future = self.send_action({
+                        self.auth_challenge_future = self.protocol.send({
                             'Action': 'Challenge',
                             'AuthType': self.auth_type.upper()})
                         self.auth_challenge_future.add_done_callback(self.secure_login)
                         return
                 self.authenticated = False
-                self.authenticated_future = self.send_action({
+                self.authenticated_future = self.protocol.send({
                     'Action': 'Login',
                     'Username': self.config['username'],
                     'Secret': self.config['secret'],
@@ -104,12 +180,14 @@ class Manager:
             self.pinger = self.loop.call_later(self.ping_delay, self.ping)
 
     def secure_login(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
         resp = future.result()
         if bool(resp.success):
             auth_challenge = resp.Challenge + self.config['secret']
             key = hashlib.md5(auth_challenge.encode('utf-8')).hexdigest()
             self.authenticated = False
-            self.authenticated_future = self.send_action({
+            self.authenticated_future = self.protocol.send({
                 'Action': 'Login',
                 'Username': self.config['username'],
                 'AuthType': self.auth_type.upper(),
@@ -119,28 +197,72 @@ class Manager:
 
     def login(self, future):
         self.authenticated_future = None
+        if future.cancelled() or future.exception() is not None:
+            # the connection was lost or the login timed out
+            self.authenticated = False
+            return False
         resp = future.result()
         self.authenticated = bool(resp.success)
         if self.authenticated:
+            if self.events_filter:
+                self.send_filters()
             self.loop.call_soon(self.on_login, self)
         if self.pinger is not None:
             self.pinger.cancel()
         self.pinger = self.loop.call_later(self.ping_delay, self.ping)
         return self.authenticated
 
+    def send_filters(self):
+        """Ask Asterisk to only send the events matching a registered pattern
+        or ``required_events``. Only new filters are sent since a filter
+        can't be removed from an AMI session.
+
+        This is done after login and when a pattern is registered if
+        ``events_filter`` is true. The AMI user needs the ``system`` write
+        permission.
+        """
+        patterns = [pattern for pattern, __ in self.patterns]
+        patterns.extend(self.required_events)
+        for pattern in patterns:
+            value = utils.event_filter(pattern)
+            if value not in self.filters:
+                self.filters.add(value)
+                self.protocol.send({'Action': 'Filter',
+                                    'Operation': 'Add',
+                                    'Filter': value})
+
     def ping(self):  # pragma: no cover
         self.pinger = self.loop.call_later(self.ping_interval, self.ping)
-        self.protocol.send({'Action': 'Ping'})
+        future = self.protocol.send({'Action': 'Ping'})
+        # nobody waits for the pong
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
 
     async def send_awaiting_actions(self, *_):
+        if self.draining:
+            return
         self.log.info('Sending awaiting actions')
-        while self.awaiting_actions:
-            action = self.awaiting_actions.popleft()
-            if action['action'].lower() not in self.forgetable_actions:
-                if not action.done():
-                    self.send_action(action, as_list=action.as_list)
+        self.draining = True
+        try:
+            while self.awaiting_actions:
+                if not self._connected:
+                    break
+                try:
+                    action = self.awaiting_actions.popleft()
+                except IndexError:
+                    # all remaining actions expired
+                    break
+                if action['action'].lower() not in self.forgetable_actions:
+                    if not action.done():
+                        self.send_action(action, as_list=action.as_list,
+                                         stream=action.stream)
+                        if self.awaiting_actions_rate:
+                            await asyncio.sleep(
+                                1 / self.awaiting_actions_rate)
+        finally:
+            self.draining = False
 
-    def send_action(self, action, as_list=None, **kwargs):
+    def send_action(self, action, as_list=None, stream=None,
+                    response_timeout=None, **kwargs):
         """Send an :class:`~panoramisk.actions.Action` to the server:
 
         :param action: an Action or dict with action name and parameters to
@@ -148,6 +270,13 @@ class Manager:
         :type action: Action or dict or Command
         :param as_list: If True, the action will retrieve all responses
         :type as_list: boolean
+        :param stream: If True, responses are released once consumed by an
+                       ``async for`` and the result is the last response.
+                       Default to the action's ``stream``
+        :type stream: boolean
+        :param response_timeout: Seconds to wait for the response(s).
+                                 Default to the ``response_timeout`` setting
+        :type response_timeout: float
         :return: an Action that will receive the response(s)
         :rtype: panoramisk.actions.Action
 
@@ -164,11 +293,53 @@ class Manager:
             async for resp in  manager.send_action({'Action': 'Status'}):
                 print(resp)
 
+        Large lists should be streamed so responses are not kept in memory::
+
+            manager = Manager()
+            action = manager.send_action({'Action': 'CoreShowChannels'},
+                                         stream=True)
+            async for resp in action:
+                print(resp)
+
+        The ``max_responses`` setting (or an Action's ``max_responses``)
+        limits the responses retained by an action. When it is reached the
+        action fails with :class:`~panoramisk.exceptions.TooManyResponses`.
+
+        When no response is received after ``response_timeout`` seconds the
+        action fails with an :class:`asyncio.TimeoutError` and is forgotten.
+        A cancelled action is forgotten too.
+
         See https://wiki.asterisk.org/wiki/display/AST/AMI+Actions for
         more information on actions
         """
         action.update(kwargs)
-        return self.protocol.send(action, as_list=as_list)
+        return self.protocol.send(action, as_list=as_list, stream=stream,
+                                  response_timeout=response_timeout)
+
+    def stale_actions(self):
+        """Return the number of actions waiting for a response for more than
+        ``stale_action_delay`` seconds. Only known when metrics are enabled
+        """
+        responses = getattr(self.protocol, 'responses', None)
+        if not responses:
+            return 0
+        limit = time.perf_counter() - float(self.config['stale_action_delay'])
+        actions = {id(a): a for a in responses.values()}.values()
+        return sum(1 for a in actions if a.sent_at and a.sent_at < limit)
+
+    async def drain(self):
+        """Wait until the connection accepts more data. Use it when sending
+        lots of actions to respect the ``write_buffer_high`` and
+        ``write_buffer_low`` watermarks:
+
+        .. code-block:: python
+
+            manager = Manager()
+            for i in range(10000):
+                manager.send_action({'Action': 'Setvar', ...})
+                await manager.drain()
+        """
+        await self.protocol.drain()
 
     def send_command(self, command, as_list=False):
         """Send a :class:`~panoramisk.actions.Command` to the server::
@@ -243,7 +414,8 @@ class Manager:
                 self.loop.run_until_complete(on_shutdown(self))
             self.loop.stop()
 
-    def register_event(self, pattern, callback=None):
+    def register_event(self, pattern, callback=None, mode=None,
+                       concurrency=None):
         """register an event. See :class:`~panoramisk.message.Message`:
 
         .. code-block:: python
@@ -262,11 +434,49 @@ class Manager:
             >>> @manager.register_event('Meetme*')
             ... def callback(manager, event):
             ...     print(manager, event)
+
+        ``mode`` sets how the pattern's callbacks are run:
+
+        - ``inline`` (the default): called in the event loop. Coroutines are
+          scheduled as tasks
+        - ``thread``: called in ``executor`` (or the loop's default executor)
+          so slow synchronous callbacks do not block the loop. Coroutines
+          are not allowed
+        - ``task``: called by ``concurrency`` (default to
+          ``callback_concurrency``) worker tasks. At most
+          ``callback_backlog`` events wait for a worker. Other events are
+          dropped and counted in the ``panoramisk_dropped_events_total``
+          metric
+
+        .. code-block:: python
+
+            >>> @manager.register_event('Hangup', mode='thread')
+            ... def save_cdr(manager, event):
+            ...     print(manager, event)
+
+        A warning is logged when a callback runs longer than
+        ``slow_callback_duration`` seconds. The duration of a coroutine is
+        the time until it is done, including the time spent waiting: it
+        does not tell if the coroutine blocked the loop.
         """
+        if mode not in (None, 'inline', 'thread', 'task'):
+            raise ValueError('Invalid mode: %r' % mode)
+
         def _register_event(callback):
+            current = mode or self.callback_modes.get(pattern, (None,))[0]
+            if current == 'thread' and asyncio.iscoroutinefunction(callback):
+                raise ValueError(
+                    'Coroutine %s can not run in a thread' % (
+                        callback_name(callback)))
+            if mode is not None:
+                self.callback_modes[pattern] = (
+                    mode, concurrency or self.callback_concurrency)
             if not self.callbacks[pattern]:
-                self.patterns.append((pattern,
-                                     re.compile(fnmatch.translate(pattern))))
+                regexp = re.compile(fnmatch.translate(pattern))
+                self.patterns.append((pattern, regexp))
+                self.index_pattern(pattern, regexp)
+                if self.events_filter and self.authenticated:
+                    self.send_filters()
             self.callbacks[pattern].append(callback)
             return callback
         if callback is not None:
@@ -274,37 +484,236 @@ class Manager:
         else:
             return _register_event
 
+    def unregister_event(self, pattern, callback):
+        """Remove a callback registered with :meth:`register_event`"""
+        callbacks = self.callbacks.get(pattern, [])
+        if callback not in callbacks:
+            raise ValueError('This callback is not registered.')
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.callbacks[pattern]
+            self.patterns = [p for p in self.patterns if p[0] != pattern]
+            self.callback_modes.pop(pattern, None)
+            self.stop_workers(pattern)
+            self.matches_cache.clear()
+            for patterns in (self.exact_patterns, self.prefix_patterns):
+                for key in list(patterns):
+                    if pattern in patterns[key]:
+                        patterns[key].remove(pattern)
+                        if not patterns[key]:
+                            del patterns[key]
+            self.wildcard_patterns = [
+                p for p in self.wildcard_patterns if p[0] != pattern]
+
+    def events(self, pattern, maxsize=1000, overflow='drop_oldest',
+               coalesce=None):
+        """Return a :class:`~panoramisk.subscription.Subscription` to
+        consume events matching ``pattern`` with an ``async for``:
+
+        .. code-block:: python
+
+            async with manager.events('Queue*', maxsize=10000) as events:
+                async for event in events:
+                    print(event)
+        """
+        subscription = Subscription(self, pattern, maxsize=maxsize,
+                                    overflow=overflow, coalesce=coalesce)
+        self.subscriptions.append(subscription)
+        self.register_event(pattern, subscription.put)
+        return subscription
+
+    def index_pattern(self, pattern, regexp):
+        """Store pattern in the lookup table matching its kind: an exact
+        event name, a prefix glob like ``Queue*`` or a real wildcard"""
+        self.matches_cache.clear()
+        if not any(c in pattern for c in '*?['):
+            self.exact_patterns[pattern].append(pattern)
+        elif (pattern.endswith('*') and
+              not any(c in pattern[:-1] for c in '*?[')):
+            self.prefix_patterns[pattern[:-1]].append(pattern)
+        else:
+            self.wildcard_patterns.append((pattern, regexp))
+
+    def match_patterns(self, name):
+        """Return registered patterns matching an event name, in
+        registration order:
+
+        .. code-block:: python
+
+            >>> manager = Manager()
+            >>> for pattern in ('Queue*', 'Peer?tatus', 'QueueMember'):
+            ...     _ = manager.register_event(pattern, print)
+            >>> manager.match_patterns('QueueMember')
+            ['Queue*', 'QueueMember']
+            >>> manager.match_patterns('PeerStatus')
+            ['Peer?tatus']
+        """
+        matches = self.matches_cache.get(name)
+        if matches is None:
+            matches = list(self.exact_patterns.get(name, ()))
+            prefixes = self.prefix_patterns
+            if prefixes:
+                for i in range(len(name) + 1):
+                    matches.extend(prefixes.get(name[:i], ()))
+            for pattern, regexp in self.wildcard_patterns:
+                if regexp.match(name) is not None:
+                    matches.append(pattern)
+            if len(matches) > 1:
+                order = {p: i for i, (p, __) in enumerate(self.patterns)}
+                matches.sort(key=order.__getitem__)
+            self.matches_cache[name] = matches
+        return matches
+
     def dispatch(self, event):
-        matches = []
         event.manager = self
-        for pattern, regexp in self.patterns:
-            match = regexp.match(event.event)
-            if match is not None:
-                matches.append(pattern)
-                for callback in self.callbacks[pattern]:
-                    ret = callback(self, event)
-                    if (asyncio.iscoroutine(ret) or
-                            isinstance(ret, asyncio.Future)):
-                        asyncio.ensure_future(ret, loop=self.loop)
-        return matches
+        name = event.event
+        matches = self.match_patterns(name)
+        if self.metrics is not None:
+            self.metrics.inc('panoramisk_events_total', event=name)
+        for pattern in matches:
+            mode, concurrency = self.callback_modes.get(
+                pattern, ('inline', None))
+            for callback in self.callbacks[pattern]:
+                if mode == 'thread':
+                    self.run_in_thread(callback, event)
+                elif mode == 'task':
+                    self.queue_task(pattern, concurrency, callback, event)
+                else:
+                    self.run_callback(callback, event)
+        return list(matches)
+
+    def run_callback(self, callback, event):
+        """Call a callback and check how long it took. Coroutines are
+        scheduled as tasks and checked when they are done"""
+        start = time.perf_counter()
+        ret = callback(self, event)
+        if asyncio.iscoroutine(ret) or isinstance(ret, asyncio.Future):
+            ret = asyncio.ensure_future(ret, loop=self.loop)
+
+            def done(future):
+                if not future.cancelled():
+                    self.callback_done(callback, event,
+                                       time.perf_counter() - start)
+            ret.add_done_callback(done)
+        else:
+            self.callback_done(callback, event, time.perf_counter() - start)
+        return ret
+
+    def callback_done(self, callback, event, duration):
+        if self.metrics is not None:
+            self.metrics.observe('panoramisk_callback_seconds', duration,
+                                 callback=callback_name(callback))
+        if (self.slow_callback_duration is not None and
+                duration > self.slow_callback_duration):
+            self.log.warning('Callback %s took %.3f seconds to handle %s',
+                             callback_name(callback), duration, event.event)
+
+    def run_in_thread(self, callback, event):
+        def run():
+            start = time.perf_counter()
+            ret = callback(self, event)
+            if asyncio.iscoroutine(ret):
+                ret.close()
+                raise TypeError('Coroutines can not run in a thread')
+            return time.perf_counter() - start
+
+        def done(future):
+            if future.cancelled():
+                return
+            exc = future.exception()
+            if exc is not None:
+                self.log.error('Callback %s failed to handle %s',
+                               callback_name(callback), event.event,
+                               exc_info=exc)
+            else:
+                self.callback_done(callback, event, future.result())
+
+        # parse lazy messages in the loop. They are not thread safe
+        event._store
+        future = self.loop.run_in_executor(self.executor, run)
+        future.add_done_callback(done)
+        return future
+
+    def queue_task(self, pattern, concurrency, callback, event):
+        if pattern not in self.task_queues:
+            queue = asyncio.Queue(self.callback_backlog)
+            workers = [self.create_task(self.run_tasks(queue))
+                       for i in range(concurrency)]
+            self.task_queues[pattern] = (queue, workers)
+        queue = self.task_queues[pattern][0]
+        try:
+            queue.put_nowait((callback, event))
+        except asyncio.QueueFull:
+            if self.metrics is not None:
+                self.metrics.inc('panoramisk_dropped_events_total',
+                                 event=event.event)
+            self.log.warning('Too many events waiting for %s. %s dropped',
+                             callback_name(callback), event.event)
+
+    async def run_tasks(self, queue):
+        while True:
+            callback, event = await queue.get()
+            try:
+                await self.run_in_task(callback, event)
+            finally:
+                queue.task_done()
+
+    async def run_in_task(self, callback, event):
+        try:
+            ret = self.run_callback(callback, event)
+            if isinstance(ret, asyncio.Future):
+                await ret
+        except Exception:
+            self.log.exception('Callback %s failed to handle %s',
+                               callback_name(callback), event.event)
+
+    def stop_workers(self, pattern=None):
+        """Cancel the tasks running callbacks for pattern (or for all
+        patterns). Events waiting for them are dropped"""
+        patterns = list(self.task_queues) if pattern is None else [pattern]
+        for pattern in patterns:
+            __, workers = self.task_queues.pop(pattern, (None, ()))
+            for worker in workers:
+                worker.cancel()
+
+    def create_task(self, coro):
+        # keep a reference to running tasks
+        task = asyncio.ensure_future(coro, loop=self.loop)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
 
     def close(self):
         """Close the connection"""
         if self.pinger:
             self.pinger.cancel()
             self.pinger = None
+        self.stop_workers()
         if getattr(self, 'protocol', None):
             self.protocol.close()
+        if self.own_recorder:
+            self.recorder.close()
+            self.recorder = None
+            self.own_recorder = False
+        elif self.recorder is not None:
+            self.recorder.flush()
 
     def connection_lost(self, exc):
         self._connected = False
+        if self.metrics is not None:
+            self.metrics.inc('panoramisk_reconnects_total')
         self.log.error('Connection lost')
         self.loop.call_soon(self.on_disconnect, self, exc)
         if self.pinger:
             self.pinger.cancel()
             self.pinger = None
         self.log.info('Try to connect again in %d second(s)' % self.reconnect_timeout)
-        self.loop.call_later(self.reconnect_timeout, self.connect)
+        self.loop.call_later(self.reconnect_timeout, self.reconnect)
+
+    def reconnect(self):
+        """Open this manager's connection again. Unlike :meth:`connect` in
+        subclasses, never opens other connections"""
+        return Manager.connect(self)
 
     @classmethod
     def from_config(cls, filename_or_fd, section='asterisk', **kwargs):
@@ -313,6 +722,12 @@ class Manager:
         return cls(**config)
 
 
+def optional_float(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
 # noinspection PyUnusedLocal
 def on_connect(manager: Manager):
     """
@@ -1,8 +1,13 @@
+import re
 from . import utils
 from urllib.parse import unquote
 
+re_kind = re.compile(r'^(?:Event|Response): ', re.M)
+re_event = re.compile(r'^Event: ([^\r\n]*)', re.M)
+re_ids = re.compile(r'^(?:ActionID|CommandID): ', re.M | re.I)
 
-class Message(utils.CaseInsensitiveDict):
+
+class Message(utils.CaseInsensitiveMapping):
     """Handle both Responses and Events with the same api:
 
     ..
@@ -34,28 +39,72 @@ class Message(utils.CaseInsensitiveDict):
         >>> event.unknown_header
         ''
 
+    Messages received from Asterisk keep the raw frame and only parse their
+    headers on first access. The ``Event`` name and the presence of an
+    ``ActionID`` are checked without parsing, so events dropped by
+    :meth:`~panoramisk.Manager.dispatch` are never parsed:
+
+    ..
+        >>> frame = utils.EOL.join(['Event: VarSet', 'Variable: x', 'Value: 1'])
+
+    .. code-block:: python
+
+        >>> event = Message.from_line(frame)
+        >>> print(event.event)
+        VarSet
+        >>> print(event.id)
+        None
+        >>> print(event.value)
+        1
+
     """
 
+    __slots__ = ('_store', '_frame', 'manager')
+
     quoted_keys = ['result']
     success_responses = ['Success', 'Follows', 'Goodbye']
 
     def __init__(self, headers, content=''):
         super(Message, self).__init__(headers, content=content)
+        self._frame = None
         self.manager = None
 
+    def __getattr__(self, attr):
+        if attr == '_store':
+            return self._parse()
+        elif attr in self.__slots__:
+            raise AttributeError(attr)
+        return self.get(attr, '')
+
+    def _parse(self):
+        headers, content = self.parse_line(self._frame)
+        store = utils.lower_store(headers.items())
+        store['content'] = ('content', content)
+        self._store = store
+        self._frame = None
+        return store
+
+    @property
+    def event(self):
+        if self._frame is not None:
+            match = re_event.search(self._frame)
+            return match.group(1) if match is not None else ''
+        return self.get('event', '')
+
     @property
     def id(self):
-        if 'commandid' in self:
-            return self['commandid']
-        elif 'actionid' in self:
-            return self['actionid']
-        return None
+        if self._frame is not None and re_ids.search(self._frame) is None:
+            return None
+        store = self._store
+        item = store.get('commandid') or store.get('actionid')
+        return item[1] if item is not None else None
 
     @property
     def action_id(self):
-        if 'actionid' in self:
-            return self['actionid']
-        return None
+        if self._frame is not None and re_ids.search(self._frame) is None:
+            return None
+        item = self._store.get('actionid')
+        return item[1] if item is not None else None
 
     @property
     def success(self):
@@ -72,7 +121,7 @@ class Message(utils.CaseInsensitiveDict):
         """
         if 'event' in self:
             return True
-        if self.response in self.success_responses:
+        if self.get('response') in self.success_responses:
             return True
         return False
 
@@ -120,6 +169,18 @@ class Message(utils.CaseInsensitiveDict):
 
     @classmethod
     def from_line(cls, line):
+        """Return a Message for a raw frame or None if the frame is neither
+        an event nor a response. Headers are parsed on first access"""
+        if re_kind.search(line) is None:
+            return None
+        message = cls.__new__(cls)
+        message._frame = line
+        message.manager = None
+        return message
+
+    @classmethod
+    def parse_line(cls, line):
+        """Return headers and content of a raw frame"""
         mlines = line.split(utils.EOL)
         headers = {}
         content = ''
@@ -141,5 +202,7 @@ class Message(utils.CaseInsensitiveDict):
                     headers[k] = o
                 else:
                     headers[k] = v
-        if 'Event' in headers or 'Response' in headers:
-            return cls(headers, content)
+        return headers, content
+
+
+utils.CaseInsensitiveDict.register(Message)
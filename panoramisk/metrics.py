@@ -0,0 +1,158 @@
+import bisect
+from collections import defaultdict
+
+
+class Metrics:
+    """A small registry of counters, histograms and gauges.
+
+    Pass it to the :class:`~panoramisk.Manager` to instrument the
+    connection:
+
+    .. code-block:: python
+
+        >>> from panoramisk import Manager
+        >>> metrics = Metrics()
+        >>> manager = Manager(metrics=metrics)
+
+    Any object with the same ``inc``, ``observe`` and ``gauge`` methods can
+    be used instead, e.g. to feed another metrics library.
+
+    The manager reports:
+
+    - ``panoramisk_events_total``: events received, by event name
+    - ``panoramisk_bytes_received_total``: bytes received
+    - ``panoramisk_frame_classify_seconds``: time spent to tell if a frame
+      is an event or a response. Headers are parsed later, on first
+      access, and are not included
+    - ``panoramisk_callback_seconds``: time spent in event callbacks, by
+      callback. Coroutines are timed until they are done
+    - ``panoramisk_dropped_events_total``: events dropped because too many
+      were waiting for a ``task`` callback, by event name
+    - ``panoramisk_action_seconds``: actions round trip, by action name
+    - ``panoramisk_reconnects_total``: lost connections
+    - ``panoramisk_pending_actions``: actions waiting for a response
+    - ``panoramisk_awaiting_actions``: actions waiting for a connection
+    - ``panoramisk_awaiting_actions_dropped``: awaiting actions dropped
+      because the queue was full
+    - ``panoramisk_awaiting_actions_expired``: awaiting actions dropped
+      after their ttl
+    - ``panoramisk_stale_actions``: actions waiting for a response for more
+      than ``stale_action_delay`` seconds
+    - ``panoramisk_action_timeouts_total``: actions failed after their
+      ``response_timeout``, by action name
+
+    Gauges are labelled with the manager's ``metrics_labels`` setting.
+    :class:`~panoramisk.pool.PoolManager` adds a ``connection`` label and
+    :class:`~panoramisk.cluster.Cluster` a ``node`` label so their managers
+    can share a registry.
+
+    Values can be exported using the Prometheus text format:
+
+    .. code-block:: python
+
+        >>> metrics.inc('panoramisk_events_total', event='Hangup')
+        >>> print(metrics.prometheus())  # doctest: +ELLIPSIS
+        # TYPE panoramisk_events_total counter
+        panoramisk_events_total{event="Hangup"} 1
+        ...
+    """
+
+    buckets = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1., 5.)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.counters = defaultdict(dict)
+        self.histograms = defaultdict(dict)
+        self.gauges = defaultdict(dict)
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = tuple(sorted(labels.items()))
+        values = self.counters[name]
+        values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value to an histogram"""
+        key = tuple(sorted(labels.items()))
+        values = self.histograms[name]
+        histogram = values.get(key)
+        if histogram is None:
+            histogram = values[key] = [[0] * len(self.buckets), 0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def gauge(self, name, func, **labels):
+        """Register a callable returning the current value of a gauge"""
+        self.gauges[name][tuple(sorted(labels.items()))] = func
+
+    def get(self, name, **labels):
+        """Return the value of a counter or gauge, or the ``(sum, count)`` of
+        an histogram"""
+        key = tuple(sorted(labels.items()))
+        if key in self.counters.get(name, {}):
+            return self.counters[name][key]
+        elif key in self.histograms.get(name, {}):
+            return tuple(self.histograms[name][key][1:])
+        elif key in self.gauges.get(name, {}):
+            return self.gauges[name][key]()
+        return None
+
+    def prometheus(self):
+        """Return all the values using the Prometheus text format"""
+        lines = []
+        for name, values in sorted(self.counters.items()):
+            lines.append('# TYPE %s counter' % name)
+            for key, value in sorted(values.items()):
+                lines.append('%s%s %s' % (name, format_labels(key),
+                                          format_value(value)))
+        for name, values in sorted(self.gauges.items()):
+            lines.append('# TYPE %s gauge' % name)
+            for key, func in sorted(values.items()):
+                lines.append('%s%s %s' % (name, format_labels(key),
+                                          format_value(func())))
+        for name, values in sorted(self.histograms.items()):
+            lines.append('# TYPE %s histogram' % name)
+            for key, (counts, total, count) in sorted(values.items()):
+                cumulative = 0
+                for bucket, value in zip(self.buckets, counts):
+                    cumulative += value
+                    labels = format_labels(key + (('le', repr(bucket)),))
+                    lines.append('%s_bucket%s %d' % (name, labels,
+                                                     cumulative))
+                labels = format_labels(key + (('le', '+Inf'),))
+                lines.append('%s_bucket%s %d' % (name, labels, count))
+                lines.append('%s_sum%s %s' % (name, format_labels(key),
+                                              format_value(total)))
+                lines.append('%s_count%s %d' % (name, format_labels(key),
+                                                count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    labels = ['%s="%s"' % (k, escape(v)) for k, v in labels]
+    return '{%s}' % ','.join(labels)
+
+
+def escape(value):
+    value = str(value).replace('\\', r'\\')
+    return value.replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def callback_name(callback):
+    """Return a readable name for a callback"""
+    name = getattr(callback, '__qualname__', None)
+    if name is None:
+        return repr(callback)
+    return '%s.%s' % (getattr(callback, '__module__', None), name)
@@ -0,0 +1,102 @@
+import asyncio
+from .manager import Manager
+
+
+class PoolManager(Manager):
+    """A Manager using several AMI connections to the same Asterisk:
+
+    .. code-block:: python
+
+        >>> manager = PoolManager(
+        ...    host='127.0.0.1',
+        ...    port=5038,
+        ...    pool_size=4,
+        ...    pool_routing='least_pending')
+        >>> len(manager.pool)
+        4
+
+    The manager's own connection receives the events. Actions are sent on
+    ``pool_size`` other connections logged in with ``Events: off`` so a busy
+    event stream does not delay their responses. ``pool_routing`` can be
+    ``round_robin`` or ``least_pending`` (the connection with the fewest
+    actions waiting for a response). Only the events connection is
+    recorded when ``record`` is set.
+    """
+
+    defaults = dict(
+        Manager.defaults,
+        pool_size=2,
+        pool_routing='round_robin',
+    )
+
+    def __init__(self, **config):
+        labels = config.get('metrics_labels') or {}
+        config['metrics_labels'] = dict(labels, connection='events')
+        super(PoolManager, self).__init__(**config)
+        self.pool_size = int(self.config['pool_size'])
+        self.pool_routing = self.config['pool_routing']
+        if self.pool_routing not in ('round_robin', 'least_pending'):
+            raise ValueError(
+                'Invalid pool_routing: %r' % self.pool_routing)
+        self.pool_index = 0
+        self.pool = [
+            Manager(**dict(self.config,
+                           events='off',
+                           record=None,
+                           metrics_labels=dict(labels, connection=str(i)),
+                           log=self.log,
+                           on_login=self.pool_login))
+            for i in range(self.pool_size)]
+
+    def pool_login(self, manager):
+        # action only connections do not receive FullyBooted
+        asyncio.ensure_future(manager.send_awaiting_actions(),
+                              loop=manager.loop)
+
+    def available(self):
+        """Return the pool's managers able to send actions"""
+        managers = []
+        for manager in self.pool:
+            protocol = manager.protocol
+            if protocol is None or protocol.closed:
+                continue
+            if 'username' in manager.config and not manager.authenticated:
+                continue
+            managers.append(manager)
+        return managers
+
+    def send_action(self, action, as_list=None, **kwargs):
+        """Send an action on one of the pool's connections. Use the events
+        connection if none is available.
+        See :meth:`~panoramisk.Manager.send_action`"""
+        managers = self.available()
+        if not managers:
+            return super(PoolManager, self).send_action(
+                action, as_list=as_list, **kwargs)
+        if self.pool_routing == 'least_pending':
+            manager = min(managers, key=lambda m: len(m.protocol.responses))
+        else:
+            self.pool_index += 1
+            manager = managers[self.pool_index % len(managers)]
+        return manager.send_action(action, as_list=as_list, **kwargs)
+
+    def connect(self, run_forever=False, on_startup=None, on_shutdown=None):
+        """connect all the pool's connections. Return a future done when
+        all of them are connected"""
+        if self.loop is None:  # pragma: no cover
+            self.loop = asyncio.get_event_loop()
+        tasks = []
+        for manager in self.pool:
+            manager.loop = self.loop
+            tasks.append(manager.connect())
+        tasks.insert(0, super(PoolManager, self).connect())
+        future = asyncio.gather(*tasks)
+        if run_forever:
+            self.run_forever(on_startup, on_shutdown)
+        return future
+
+    def close(self):
+        """Close all the connections"""
+        for manager in self.pool:
+            manager.close()
+        super(PoolManager, self).close()
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+header = struct.Struct('!dI')
+
+
+class Recorder:
+    """Record the raw data received by a :class:`~panoramisk.Manager`:
+
+    .. code-block:: python
+
+        manager = Manager(record=Recorder('/var/log/ami.rec',
+                                          max_bytes=100 * 1024 * 1024))
+
+    Each chunk is stored with the time it was received. Chunks are kept in
+    memory and written by a thread when ``buffer_size`` bytes are buffered
+    or after ``flush_interval`` seconds so the event loop never waits for
+    the disk. When the file is bigger than ``max_bytes`` it is renamed to
+    ``path.1`` (``path.1`` to ``path.2``, ... up to ``backup_count``).
+    """
+
+    def __init__(self, path, max_bytes=None, backup_count=5,
+                 buffer_size=64 * 1024, flush_interval=1.):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.chunks = []
+        self.buffered = 0
+        self.flusher = None
+        self.fd = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def write(self, data):
+        """Buffer a chunk of data"""
+        self.chunks.append(header.pack(time.time(), len(data)))
+        self.chunks.append(data)
+        self.buffered += header.size + len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        elif self.flusher is None:
+            loop = asyncio.get_event_loop()
+            self.flusher = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Write buffered data in the recorder's thread"""
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        if self.chunks:
+            chunks, size = self.chunks, self.buffered
+            self.chunks, self.buffered = [], 0
+            return self.executor.submit(self.write_chunks, chunks, size)
+
+    def write_chunks(self, chunks, size):
+        if self.fd is None:
+            self.fd = open(self.path, 'ab')
+        position = self.fd.tell()
+        if self.max_bytes and position and position + size > self.max_bytes:
+            self.rotate()
+        self.fd.writelines(chunks)
+        self.fd.flush()
+
+    def rotate(self):
+        self.fd.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            name = '%s.%d' % (self.path, i)
+            if os.path.exists(name):
+                os.replace(name, '%s.%d' % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.fd = open(self.path, 'ab')
+
+    def close(self):
+        """Write buffered data and close the file"""
+        self.flush()
+        self.executor.shutdown(wait=True)
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+
+def read_records(path):
+    """Iter over ``(timestamp, data)`` records of a recording"""
+    with open(path, 'rb') as fd:
+        while True:
+            head = fd.read(header.size)
+            if len(head) < header.size:
+                return
+            timestamp, size = header.unpack(head)
+            yield timestamp, fd.read(size)
+
+
+class ReplayTransport(asyncio.Transport):
+    """Transport used to replay a recording. Written data is dropped"""
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+
+async def replay(manager, path, speed=None):
+    """Feed a recording to a manager which is not connected to Asterisk.
+    With a ``speed`` of 1 the data is received at the same pace as it was
+    recorded, 2 is twice faster, etc. Without ``speed`` the data is received
+    as fast as possible. Return the number of chunks replayed::
+
+        manager = Manager()
+        manager.register_event('*', callback)
+        await replay(manager, '/var/log/ami.rec')
+    """
+    loop = asyncio.get_event_loop()
+    if manager.loop is None:
+        manager.loop = loop
+    protocol = manager.config['protocol_factory']()
+    future = loop.create_future()
+    future.set_result((ReplayTransport(), protocol))
+    protocol.connection_made(ReplayTransport())
+    manager.connection_made(future)
+    count = 0
+    start = first = None
+    for timestamp, data in read_records(path):
+        if speed:
+            if first is None:
+                start, first = loop.time(), timestamp
+            delay = (timestamp - first) / speed - (loop.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif not count % 100:
+            # let callbacks' tasks run
+            await asyncio.sleep(0)
+        protocol.data_received(data)
+        count += 1
+    return count
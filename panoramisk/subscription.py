@@ -0,0 +1,90 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+
+
+class Subscription:
+    """A bounded queue of events used as an async iterator. Use
+    :meth:`~panoramisk.Manager.events` to get one:
+
+    .. code-block:: python
+
+        async with manager.events('Queue*', maxsize=10000) as events:
+            async for event in events:
+                await save(event)
+
+    When the queue is full, ``overflow`` says which event is lost:
+    ``drop_oldest`` or ``drop_newest``. ``coalesce`` can be a callable
+    returning a key for an event. A queued event is then replaced by a new
+    event with the same key instead of queuing both.
+
+    ``received``, ``dropped`` and ``coalesced`` count events and ``lag`` is
+    the number of events waiting to be consumed.
+    """
+
+    def __init__(self, manager, pattern, maxsize=1000, overflow='drop_oldest',
+                 coalesce=None):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError('Invalid overflow policy: %r' % overflow)
+        self.manager = manager
+        self.pattern = pattern
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.coalesce = coalesce
+        self.queue = OrderedDict()
+        self.counter = itertools.count()
+        self.waiter = None
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def lag(self):
+        return len(self.queue)
+
+    def put(self, manager, event):
+        """Callback used to receive events from the manager"""
+        self.received += 1
+        if self.coalesce is not None:
+            key = self.coalesce(event)
+            if key in self.queue:
+                self.queue[key] = event
+                self.coalesced += 1
+                return
+        else:
+            key = next(self.counter)
+        if self.maxsize and len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            if self.overflow == 'drop_newest':
+                return
+            self.queue.popitem(last=False)
+        self.queue[key] = event
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def close(self):
+        """Stop receiving events. Iteration stops once the queue is empty"""
+        if not self.closed:
+            self.closed = True
+            self.manager.unregister_event(self.pattern, self.put)
+            self.manager.subscriptions.remove(self)
+            if self.waiter is not None and not self.waiter.done():
+                self.waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = asyncio.get_event_loop().create_future()
+            await self.waiter
+        return self.queue.popitem(last=False)[1]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
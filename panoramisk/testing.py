@@ -1,5 +1,8 @@
 from __future__ import unicode_literals
 import asyncio
+import hashlib
+import itertools
+import time
 from unittest import mock
 
 from . import manager
@@ -19,9 +22,11 @@ class AMIProtocol(manager.AMIProtocol):
         super(AMIProtocol, self).connection_made(transport)
         self.transport = MagicMock()
 
-    def send(self, data, as_list=False):
+    def send(self, data, as_list=False, stream=None, response_timeout=None):
         utils.IdGenerator.reset(uid='transaction_uid')
-        future = super(AMIProtocol, self).send(data, as_list=as_list)
+        future = super(AMIProtocol, self).send(
+            data, as_list=as_list, stream=stream,
+            response_timeout=response_timeout)
         if getattr(self.factory, 'stream', None) is not None:
             with open(self.factory.stream, 'rb') as fd:
                 for resp in fd.read().split(b'\n\n'):
@@ -60,3 +65,168 @@ class Manager(manager.Manager):
 
         utils.IdGenerator.reset(uid='transaction_uid')
         utils.EOL = '\n'
+
+
+class AMIServerProtocol(asyncio.Protocol):
+    """A connection to :class:`AMIServer`"""
+
+    eol = '\r\n'
+
+    def __init__(self, server):
+        self.server = server
+        self.buffer = b''
+        self.authenticated = False
+        self.events = False
+        self.challenge = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.add(self)
+        transport.write(
+            ('Asterisk Call Manager/%s' % self.server.version + self.eol).encode())
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        separator = (self.eol * 2).encode()
+        *frames, self.buffer = self.buffer.split(separator)
+        for frame in frames:
+            action = utils.CaseInsensitiveDict()
+            for line in frame.decode().split(self.eol):
+                if ': ' in line:
+                    key, value = line.split(': ', 1)
+                    action[key] = value
+            self.handle_action(action)
+
+    def write(self, *headers, **kwargs):
+        lines = ['%s: %s' % h for h in headers]
+        lines.extend('%s: %s' % h for h in kwargs.items())
+        self.transport.write(
+            (self.eol.join(lines) + self.eol * 2).encode())
+
+    def handle_action(self, action):
+        name = action.get('action', '').lower()
+        action_id = ('ActionID', action.get('actionid', ''))
+        if name == 'challenge':
+            self.challenge = '%09d' % next(self.server.counter)
+            self.write(('Response', 'Success'), action_id,
+                       Challenge=self.challenge)
+        elif name == 'login':
+            if action.get('username') != self.server.username:
+                secret = None
+            elif 'key' in action and self.challenge is not None:
+                secret = hashlib.md5(
+                    (self.challenge + self.server.secret).encode()
+                ).hexdigest()
+                secret = self.server.secret if secret == action['key'] else None
+            else:
+                secret = action.get('secret')
+            if secret == self.server.secret:
+                self.authenticated = True
+                self.events = action.get('events', 'on').lower() != 'off'
+                self.write(('Response', 'Success'), action_id,
+                           Message='Authentication accepted')
+                if self.events:
+                    self.write(('Event', 'FullyBooted'),
+                               Privilege='system,all', Status='Fully Booted')
+            else:
+                self.write(('Response', 'Error'), action_id,
+                           Message='Authentication failed')
+        elif not self.authenticated:
+            self.write(('Response', 'Error'), action_id,
+                       Message='Permission denied')
+        elif name == 'ping':
+            self.write(('Response', 'Success'), action_id,
+                       Ping='Pong', Timestamp='%.6f' % time.time())
+        elif name == 'command':
+            output = self.server.commands.get(
+                action.get('command', ''), 'No such command')
+            headers = [('Response', 'Success'), action_id,
+                       ('Message', 'Command output follows')]
+            headers.extend(('Output', line) for line in output.split('\n'))
+            self.write(*headers)
+        elif name == 'logoff':
+            self.write(('Response', 'Goodbye'), action_id,
+                       Message='Thanks for all the fish.')
+            self.transport.close()
+        else:
+            self.write(('Response', 'Error'), action_id,
+                       Message='Invalid/unknown command')
+
+
+class AMIServer:
+    """An asyncio AMI server to test or benchmark a real
+    :class:`~panoramisk.Manager`. It handles ``Login`` (including MD5
+    challenge), ``Ping``, ``Command`` and ``Logoff`` and can emit synthetic
+    events:
+
+    .. code-block:: python
+
+        server = testing.AMIServer(username='username', secret='secret')
+        await server.start('127.0.0.1', 5038)
+        # 1000 events/s during 10 seconds
+        await server.emit(10000, rate=1000)
+        server.close()
+    """
+
+    def __init__(self, username='username', secret='secret',
+                 version='5.0.1', commands=None):
+        self.username = username
+        self.secret = secret
+        self.version = version
+        self.commands = dict(commands or {
+            'core show version': 'Asterisk 18.0.0 (simulator)'})
+        self.connections = set()
+        self.counter = itertools.count(100000000)
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening. Return the port used"""
+        loop = asyncio.get_event_loop()
+        self.server = await loop.create_server(
+            lambda: AMIServerProtocol(self), host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def broadcast(self, data):
+        """Send raw data to all the connections receiving events"""
+        for connection in list(self.connections):
+            if connection.events:
+                connection.transport.write(data)
+
+    async def emit(self, count, rate=None, event=None):
+        """Send ``count`` events to the connections receiving events,
+        ``rate`` events per second or as fast as possible. ``event`` is a
+        callable returning the headers of the nth event"""
+        if event is None:
+            def event(i):
+                return [('Event', 'VarSet'),
+                        ('Channel', 'PJSIP/%04d-00000001' % (i % 1000)),
+                        ('Variable', 'COUNTER'),
+                        ('Value', str(i)),
+                        ('Uniqueid', '1600000000.%d' % i)]
+        eol = AMIServerProtocol.eol
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        interval = .01
+        sent = 0
+        while sent < count:
+            if rate:
+                batch = int((loop.time() - start) * rate) - sent + 1
+            else:
+                batch = 1000
+            batch = max(0, min(batch, count - sent))
+            data = ''.join(
+                eol.join('%s: %s' % h for h in event(i)) + eol * 2
+                for i in range(sent, sent + batch))
+            self.broadcast(data.encode())
+            sent += batch
+            await asyncio.sleep(interval if rate else 0)
+        return sent
+
+    def close(self):
+        for connection in list(self.connections):
+            connection.transport.close()
+        if self.server is not None:
+            self.server.close()
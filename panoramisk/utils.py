@@ -1,4 +1,6 @@
+import itertools
 import re
+import sys
 import uuid
 
 try:
@@ -84,6 +86,48 @@ def agi_code_check(code, response, line):
     return result
 
 
+def event_filter(pattern):
+    """Convert an event pattern to a regexp usable by the AMI ``Filter``
+    action:
+
+    .. code-block:: python
+
+        >>> print(event_filter('QueueMember'))
+        ^Event: QueueMember[[:space:]]
+        >>> print(event_filter('Queue*'))
+        ^Event: Queue
+        >>> print(event_filter('Peer?tatus'))
+        ^Event: Peer.tatus[[:space:]]
+        >>> event_filter('*')
+        '^Event: '
+    """
+    regexp = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            regexp += '.*'
+        elif c == '?':
+            regexp += '.'
+        elif c == '[' and ']' in pattern[i + 2:]:
+            j = pattern.index(']', i + 2)
+            chars = pattern[i + 1:j]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regexp += '[' + chars + ']'
+            i = j
+        elif c in '.^$+()[]{}|\\':
+            regexp += '\\' + c
+        else:
+            regexp += c
+        i += 1
+    if regexp.endswith('.*'):
+        regexp = regexp[:-2]
+    else:
+        regexp += '[[:space:]]'
+    return '^Event: ' + regexp
+
+
 class IdGenerator:
     """Generate some uuid for actions:
 
@@ -99,9 +143,12 @@ class IdGenerator:
     .. code-block:: python
 
         >>> print(g())
-        mycounter/an_uuid4/1/1
+        mycounter/an_uuid4/1
         >>> print(g())
-        mycounter/an_uuid4/1/2
+        mycounter/an_uuid4/2
+
+    The uid is a short random string so ids stay cheap to build, send and
+    hash.
     """
 
     instances = []
@@ -109,17 +156,11 @@ class IdGenerator:
     def __init__(self, prefix):
         self.instances.append(self)
         self.prefix = prefix
-        self.uid = str(uuid.uuid4())
+        self.uid = uuid.uuid4().hex[:8]
         self.generator = self.get_generator()
 
     def get_generator(self):
-        i = 0
-        max_val = 10000
-        while True:
-            yield "%s/%s/%d/%d" % (self.prefix,
-                                   self.uid, (i // max_val) + 1,
-                                   (i % max_val) + 1)
-            i += 1
+        return itertools.count(1)
 
     @classmethod
     def reset(cls, uid=None):
@@ -137,52 +178,113 @@ class IdGenerator:
                 for i in self.instances]
 
     def __call__(self):
-        return next(self.generator)
+        return '%s/%s/%d' % (self.prefix, self.uid, next(self.generator))
 
     def __repr__(self):
         return "<%s prefix:%s (uid:%s)>" % (self.__class__.__name__, self.prefix, self.uid)
 
 
-class CaseInsensitiveDict(MutableMapping):
+# lowercased keys by key. Common AMI headers are interned, others are added
+# when seen
+lower_keys = {}
+lower_keys_maxsize = 4096
+
+for key in (
+        'Event', 'Response', 'ActionID', 'CommandID', 'Message', 'EventList',
+        'ListItems', 'SubEvent', 'Privilege', 'Channel', 'ChannelState',
+        'ChannelStateDesc', 'CallerIDNum', 'CallerIDName', 'ConnectedLineNum',
+        'ConnectedLineName', 'Language', 'AccountCode', 'Context', 'Exten',
+        'Priority', 'Uniqueid', 'Linkedid', 'Application', 'AppData',
+        'Variable', 'Value', 'Queue', 'Interface', 'MemberName', 'Status',
+        'Paused', 'Output', 'Result', 'Cause', 'Cause-txt', 'Timestamp',
+        'SystemName', 'Action', 'Command', 'Username', 'Secret', 'Events',
+        'Ping', 'content'):
+    key = sys.intern(key)
+    lower_keys[key] = lower_keys[key.lower()] = sys.intern(key.lower())
+del key
+
+
+def lower_key(key):
+    """Return the lowercased key, using the cache when possible"""
+    lkey = lower_keys.get(key)
+    if lkey is None:
+        lkey = key.lower()
+        if len(lower_keys) < lower_keys_maxsize:
+            lower_keys[key] = lkey
+    return lkey
+
+
+def lower_store(items):
+    """Return the store of a :class:`CaseInsensitiveMapping` for some
+    ``(key, value)`` pairs"""
+    store = {}
+    get = lower_keys.get
+    for key, value in items:
+        lkey = get(key)
+        if lkey is None:
+            lkey = lower_key(key)
+        store[lkey] = (key, value)
+    return store
+
+
+class CaseInsensitiveMapping(MutableMapping):
+    """Base class of :class:`CaseInsensitiveDict`.
+
+    It only implements the mapping api on top of a ``_store`` attribute and
+    has no instance ``__dict__`` so subclasses can use ``__slots__``.
     """
-    A case-insensitive ``dict``-like object.
-
-    Implements all methods and operations of ``collections.MutableMapping``.
-
-    All keys are expected to be strings. The structure remembers the
-    case of the last key to be set, and ``iter(instance)``,
-    ``keys()``, ``items()``, ``iterkeys()``, and ``iteritems()``
-    will contain case-sensitive keys. However, querying and contains
-    testing is case insensitive:
 
-    .. code-block:: python
-
-        cid = CaseInsensitiveDict()
-        cid['Action'] = 'SIPnotify'
-        cid['aCTION'] == 'SIPnotify'  # True
-        list(cid) == ['Action']  # True
+    __slots__ = ()
 
-    For example, ``event['actionid']`` will return the
-    value of a ``'ActionID'`` response event, regardless
-    of how the event name was originally stored.
-    """
     def __init__(self, data=None, **kwargs):
-        self._store = dict()
-        self.update(data or {}, **kwargs)
+        if type(data) is dict:
+            self._store = lower_store(data.items())
+        else:
+            self._store = dict()
+            if data:
+                self.update(data)
+        if kwargs:
+            self._store.update(lower_store(kwargs.items()))
+
+    @classmethod
+    def from_items(cls, items):
+        """Build an instance from ``(key, value)`` pairs without going
+        through ``__init__`` and ``update()``"""
+        self = cls.__new__(cls)
+        self._store = lower_store(items)
+        return self
 
     def __setitem__(self, key, value):
         # Use the lowercased key for lookups, but store the actual
         # key alongside the value.
-        self._store[key.lower()] = (key, value)
+        lkey = lower_keys.get(key)
+        if lkey is None:
+            lkey = lower_key(key)
+        self._store[lkey] = (key, value)
 
     def __contains__(self, key):
-        return key.lower() in self._store
+        lkey = lower_keys.get(key)
+        if lkey is None:
+            lkey = lower_key(key)
+        return lkey in self._store
 
     def __getattr__(self, attr):
         return self.get(attr, '')
 
+    def get(self, key, default=None):
+        lkey = lower_keys.get(key)
+        if lkey is None:
+            lkey = lower_key(key)
+        item = self._store.get(lkey)
+        if item is None:
+            return default
+        return item[1]
+
     def __getitem__(self, key):
-        return self._store[key.lower()][1]
+        lkey = lower_keys.get(key)
+        if lkey is None:
+            lkey = lower_key(key)
+        return self._store[lkey][1]
 
     def __delitem__(self, key):
         raise NotImplementedError()
@@ -197,6 +299,31 @@ class CaseInsensitiveDict(MutableMapping):
         return str(dict(self.items()))
 
 
+class CaseInsensitiveDict(CaseInsensitiveMapping):
+    """
+    A case-insensitive ``dict``-like object.
+
+    Implements all methods and operations of ``collections.MutableMapping``.
+
+    All keys are expected to be strings. The structure remembers the
+    case of the last key to be set, and ``iter(instance)``,
+    ``keys()``, ``items()``, ``iterkeys()``, and ``iteritems()``
+    will contain case-sensitive keys. However, querying and contains
+    testing is case insensitive:
+
+    .. code-block:: python
+
+        cid = CaseInsensitiveDict()
+        cid['Action'] = 'SIPnotify'
+        cid['aCTION'] == 'SIPnotify'  # True
+        list(cid) == ['Action']  # True
+
+    For example, ``event['actionid']`` will return the
+    value of a ``'ActionID'`` response event, regardless
+    of how the event name was originally stored.
+    """
+
+
 def config(filename_or_fd, section='asterisk'):
     config = ConfigParser()
     if hasattr(filename_or_fd, 'read'):
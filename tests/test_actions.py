@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+import pytest
+from panoramisk.actions import Action
+from panoramisk.actions import AwaitingActions
+from panoramisk.exceptions import TooManyResponses
+from panoramisk.message import Message
+
+
+def event(name, **headers):
+    headers['Event'] = name
+    return Message(headers)
+
+
+@pytest.mark.asyncio
+async def test_async_iteration(event_loop):
+    action = Action({'Action': 'QueueStatus'})
+    messages = [Message({'Response': 'Success',
+                         'EventList': 'start',
+                         'Message': 'Queue status will follow'})]
+    messages += [event('QueueMember', Name=str(i)) for i in range(10)]
+    messages += [event('QueueStatusComplete')]
+    for i, message in enumerate(messages):
+        event_loop.call_later(i * .001, action.add_message, message)
+
+    start = event_loop.time()
+    received = [message async for message in action]
+    assert received == messages
+    # no polling delay
+    assert event_loop.time() - start < .1
+
+
+@pytest.mark.asyncio
+async def test_async_iteration_cancelled(event_loop):
+    action = Action({'Action': 'QueueStatus'})
+    event_loop.call_soon(action.cancel)
+    received = [message async for message in action]
+    assert received == []
+    assert action.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_multi_is_decided_once():
+    action = Action({'Action': 'QueueStatus'})
+    action.add_message(Message({'Response': 'Success',
+                                'Message': 'Queue status will follow'}))
+    first = action.responses[0]
+    assert action.multi is True
+    first['Message'] = 'Done'
+    assert action.multi is True
+    assert not action.add_message(event('QueueMember'))
+    assert action.add_message(event('QueueStatusComplete'))
+    assert len(action.result()) == 3
+
+
+@pytest.mark.asyncio
+async def test_terminal_events():
+    for name in ('AsyncAGIExec', 'CoreShowChannelsComplete'):
+        action = Action({'Action': 'CoreShowChannels'}, as_list=True)
+        action.add_message(Message({'Response': 'Success',
+                                    'EventList': 'start'}))
+        assert not action.add_message(event('CoreShowChannel'))
+        assert action.add_message(event(name))
+
+
+def queue_status(count):
+    yield Message({'Response': 'Success', 'EventList': 'start',
+                   'Message': 'Queue status will follow'})
+    for i in range(count):
+        yield event('QueueMember', Name=str(i))
+    yield event('QueueStatusComplete', EventList='Complete')
+
+
+@pytest.mark.asyncio
+async def test_stream(event_loop):
+    action = Action({'Action': 'QueueStatus'}, stream=True)
+
+    async def feed():
+        for message in queue_status(100):
+            action.add_message(message)
+            await asyncio.sleep(0)
+
+    task = asyncio.ensure_future(feed())
+    retained = []
+    received = []
+    async for message in action:
+        received.append(message)
+        retained.append(len(action.responses))
+    await task
+    assert len(received) == 102
+    assert max(retained) < 5
+    assert action.result() is received[-1]
+    assert action.responses == []
+
+
+@pytest.mark.asyncio
+async def test_stream_single_response():
+    action = Action({'Action': 'Ping'}, stream=True)
+    response = Message({'Response': 'Success', 'Ping': 'Pong'})
+    assert action.add_message(response)
+    assert action.result() is response
+
+
+@pytest.mark.asyncio
+async def test_max_responses():
+    action = Action({'Action': 'QueueStatus'}, max_responses=10)
+    messages = list(queue_status(20))
+    results = [action.add_message(message) for message in messages]
+    assert results[-1] is True
+    assert not any(results[:-1])
+    assert action.responses == []
+    assert action.received == 22
+    with pytest.raises(TooManyResponses):
+        action.result()
+
+
+@pytest.mark.asyncio
+async def test_max_responses_stream(event_loop):
+    action = Action({'Action': 'QueueStatus'}, stream=True, max_responses=5)
+    for message in queue_status(20):
+        action.add_message(message)
+    with pytest.raises(TooManyResponses):
+        async for message in action:
+            pass  # pragma: no cover
+
+
+@pytest.mark.asyncio
+async def test_awaiting_actions_ttl():
+    queue = AwaitingActions(ttl=60)
+    expired = Action({'Action': 'Originate'}, replay_ttl=0)
+    queue.append(expired)
+    queue.append(Action({'Action': 'Originate'}))
+    assert len(queue) == 2
+    action = queue.popleft()
+    assert action is not expired
+    assert expired.cancelled()
+    assert queue.expired == 1
+    with pytest.raises(IndexError):
+        queue.popleft()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('eviction,kept', [
+    ('oldest', ['2', '3']),
+    ('newest', ['1', '2']),
+    ('priority', ['1', '3']),
+])
+async def test_awaiting_actions_eviction(eviction, kept):
+    queue = AwaitingActions(maxsize=2, eviction=eviction)
+    queue.append(Action({'Action': 'Setvar', 'Value': '1'}))
+    queue.append(Action({'Action': 'Setvar', 'Value': '2'},
+                        replay_priority=1))
+    queue.append(Action({'Action': 'Setvar', 'Value': '3'}))
+    assert sorted(action['Value'] for action in queue) == kept
+    assert queue.dropped == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('eviction', ['oldest', 'newest', 'priority'])
+async def test_awaiting_actions_eviction_many(eviction):
+    queue = AwaitingActions(maxsize=10000, eviction=eviction)
+    actions = [Action({'Action': 'Setvar', 'Value': str(i)},
+                      replay_priority=i % 3)
+               for i in range(15000)]
+    start = time.monotonic()
+    for action in actions:
+        queue.append(action)
+    assert time.monotonic() - start < 1
+    assert len(queue) == 10000
+    assert queue.dropped == 5000
+    assert sum(action.cancelled() for action in actions) == 5000
+    if eviction == 'oldest':
+        assert all(action.cancelled() for action in actions[:5000])
+    elif eviction == 'newest':
+        assert all(action.cancelled() for action in actions[10000:])
+    else:
+        assert all(action.cancelled() == (action.replay_priority == 2)
+                   for action in actions)
+    sent = []
+    while queue:
+        sent.append(queue.popleft())
+    assert len(sent) == 10000
+    assert [a.replay_priority for a in sent] == sorted(
+        a.replay_priority for a in sent)
+    assert not any(action.cancelled() for action in sent)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('eviction', ['oldest', 'priority'])
+async def test_awaiting_actions_compaction(eviction):
+    queue = AwaitingActions(maxsize=10000, eviction=eviction)
+    for i in range(200):
+        for j in range(50):
+            queue.append(Action({'Action': 'Ping'}))
+        while queue:
+            queue.popleft()
+    assert len(queue) == 0
+    assert len(queue.heap) + len(queue.order) + len(queue.victims) < 100
+
+
+def test_awaiting_actions_invalid_eviction():
+    with pytest.raises(ValueError):
+        AwaitingActions(eviction='random')
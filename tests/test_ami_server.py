@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from panoramisk import Manager
+from panoramisk import testing
+from panoramisk import utils
+
+
+@pytest.fixture
+def server(event_loop, monkeypatch):
+    monkeypatch.setattr(utils, 'EOL', '\r\n')
+    server = testing.AMIServer(username='user', secret='secret')
+    yield server
+    server.close()
+
+
+async def connect(server, **config):
+    port = await server.start()
+    manager = Manager(loop=asyncio.get_event_loop(), port=port,
+                      username='user', **config)
+    await manager.connect()
+    authenticated = await manager.authenticated_future
+    return manager, authenticated
+
+
+@pytest.mark.asyncio
+async def test_login(server):
+    manager, authenticated = await connect(server, secret='secret')
+    assert authenticated.success
+    assert manager.protocol.version == '5.0.1'
+    ping = await manager.send_action({'Action': 'Ping'})
+    assert ping.ping == 'Pong'
+    resp = await manager.send_command('core show version')
+    assert resp.output == 'Asterisk 18.0.0 (simulator)'
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_login_md5(server):
+    manager = Manager(loop=asyncio.get_event_loop(),
+                      port=await server.start(),
+                      username='user', secret='secret', auth_type='md5')
+    await manager.connect()
+    await manager.auth_challenge_future
+    while manager.authenticated_future is None:
+        await asyncio.sleep(0)
+    authenticated = await manager.authenticated_future
+    assert authenticated.success
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_login_failed(server):
+    manager, authenticated = await connect(server, secret='wrong')
+    assert not authenticated.success
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_emit(server):
+    manager, authenticated = await connect(server, secret='secret')
+    events = manager.events('VarSet', maxsize=0)
+    assert await server.emit(50, rate=5000) == 50
+    while events.received < 50:
+        await asyncio.sleep(.01)
+    assert events.received == 50
+    manager.close()
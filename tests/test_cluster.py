@@ -0,0 +1,88 @@
+import pytest
+from panoramisk import testing
+from panoramisk.ami_protocol import AMIProtocol
+from panoramisk.cluster import Cluster
+from panoramisk.message import Message
+from panoramisk.recording import Recorder
+
+
+@pytest.fixture
+def cluster(event_loop):
+    cluster = Cluster(loop=event_loop)
+    for name in ('pbx1', 'pbx2'):
+        manager = cluster.add_node(name)
+        manager.protocol = AMIProtocol()
+        manager.protocol.connection_made(testing.MagicMock())
+        manager.protocol.loop = event_loop
+        manager.protocol.factory = manager
+    return cluster
+
+
+def test_register_event(cluster):
+    events = []
+
+    @cluster.register_event('Peer*')
+    def callback(manager, event):
+        events.append((manager.node, event))
+
+    cluster.add_node('pbx3')
+    for name, manager in cluster.managers.items():
+        manager.dispatch(Message({'Event': 'PeerStatus'}))
+    assert [node for node, event in events] == ['pbx1', 'pbx2', 'pbx3']
+    assert events[0][1].manager.node == 'pbx1'
+
+
+def test_add_node_twice(cluster):
+    with pytest.raises(ValueError):
+        cluster.add_node('pbx1')
+    cluster.del_node('pbx1')
+    assert list(cluster.managers) == ['pbx2']
+
+
+def test_record_is_not_shared(event_loop, tmpdir):
+    recorder = Recorder(str(tmpdir.join('pbx2.rec')))
+    cluster = Cluster(loop=event_loop, record=str(tmpdir.join('ami.rec')))
+    assert cluster.add_node('pbx1').recorder is None
+    assert cluster.add_node('pbx2', record=recorder).recorder is recorder
+    recorder.close()
+
+
+@pytest.mark.asyncio
+async def test_broadcast(cluster, event_loop):
+    cluster.managers['pbx2'].protocol.closed = True
+
+    def answer():
+        for manager in cluster.managers.values():
+            for action in list(manager.protocol.responses.values()):
+                manager.protocol.handle_message(Message({
+                    'Response': 'Success',
+                    'ActionID': action.action_id,
+                    'Ping': 'Pong'}))
+
+    event_loop.call_soon(answer)
+    results = await cluster.broadcast({'Action': 'Ping'})
+    assert list(results) == ['pbx1']
+    assert results['pbx1'].ping == 'Pong'
+
+
+@pytest.mark.asyncio
+async def test_broadcast_timeout(cluster):
+    results = await cluster.broadcast({'Action': 'Ping'}, timeout=.01)
+    assert list(results) == ['pbx1', 'pbx2']
+    assert all(isinstance(r, Exception) for r in results.values())
+
+
+def test_health(cluster):
+    manager = cluster.managers['pbx1']
+    health = cluster.health['pbx1']
+    cluster.on_connect(manager)
+    cluster.on_login(manager)
+    assert health['state'] == 'authenticated'
+    assert health['reconnects'] == 0
+    error = ConnectionError()
+    cluster.on_disconnect(manager, error)
+    assert health['state'] == 'disconnected'
+    assert health['error'] is error
+    cluster.on_connect(manager)
+    assert health['state'] == 'connected'
+    assert health['reconnects'] == 1
@@ -1,7 +1,17 @@
 import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from panoramisk.exceptions import AGIAppError
+from panoramisk.exceptions import AGIInvalidCommand
 from panoramisk.fast_agi import Application
+from panoramisk.fast_agi import Request
+from panoramisk.fast_agi import Router
 
 FAST_AGI_PAYLOAD = b'''agi_network: yes
 agi_network_script: call_waiting
@@ -117,3 +127,285 @@ async def test_fast_agi_application_error(event_loop, unused_tcp_port):
     server.close()
     await server.wait_closed()
     await asyncio.sleep(1)  # Wait the end of endpoint
+
+
+class Writer:
+
+    closed = False
+
+    def __init__(self):
+        self.data = []
+        self.drained = 0
+
+    def write(self, data):
+        self.data.append(data)
+
+    async def drain(self):
+        self.drained += 1
+
+    def get_extra_info(self, name):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_fast_agi_headers(event_loop):
+    fa_app = Application(loop=event_loop)
+    reader = asyncio.StreamReader()
+    reader.feed_data(FAST_AGI_PAYLOAD)
+    headers = await fa_app.read_headers(reader, Writer())
+    assert len(headers) == 23
+    assert headers['agi_network_script'] == 'call_waiting'
+    assert headers['agi_calleridname'] == 'user 201'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('payload', [
+    FAST_AGI_PAYLOAD[:100],
+    b'agi_arg_1: ' + b'x' * 20000 + b'\n\n',
+])
+async def test_fast_agi_invalid_headers(event_loop, payload):
+    fa_app = Application(loop=event_loop)
+    fa_app.add_route('call_waiting', call_waiting)
+    reader = asyncio.StreamReader()
+    reader.feed_data(payload)
+    reader.feed_eof()
+    writer = Writer()
+    await fa_app.handler(reader, writer)
+    assert writer.closed
+
+
+def agi_request(app, data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    return Request(app, {}, reader, Writer())
+
+
+@pytest.mark.asyncio
+async def test_send_commands(event_loop):
+    fa_app = Application(loop=event_loop)
+    request = agi_request(fa_app, b'200 result=1\n100 Trying...\n'
+                                  b'200 result=0\n510 Invalid\n')
+    results = await request.send_commands(['SET VARIABLE X 1', 'ANSWER',
+                                           'INVALID'])
+    assert request.writer.data == [b'SET VARIABLE X 1\nANSWER\nINVALID\n']
+    assert request.writer.drained == 1
+    assert [r['status_code'] for r in results] == [200, 200, 510]
+    assert results[2]['error'] == 'AGIInvalidCommand'
+
+
+@pytest.mark.asyncio
+async def test_send_commands_raise_on_error(event_loop):
+    fa_app = Application(loop=event_loop, raise_on_error=True)
+    request = agi_request(fa_app, b'510 Invalid\n200 result=0\n'
+                                  b'200 result=1\n')
+    with pytest.raises(AGIInvalidCommand):
+        await request.send_commands(['INVALID', 'ANSWER'])
+    # the result of ANSWER was read
+    result = await request.send_command('GET VARIABLE X')
+    assert result['result'] == ('1', '')
+
+
+@pytest.mark.asyncio
+async def test_send_commands_nowait(event_loop):
+    fa_app = Application(loop=event_loop, raise_on_error=True)
+    request = agi_request(fa_app, b'200 result=1\n510 Invalid\n'
+                                  b'200 result=0\n200 result=1\n')
+    assert await request.send_commands(['SET VARIABLE X 1', 'INVALID'],
+                                       wait=False) is None
+    await request.send_commands(['SET VARIABLE Y 1'], wait=False)
+    assert request.writer.drained == 0
+    result = await request.send_command('ANSWER')
+    assert result['result'] == ('1', '')
+    results = await request.collect()
+    assert [r['status_code'] for r in results] == [200, 510, 200]
+    assert results[1]['error'] == 'AGIInvalidCommand'
+    assert await request.collect() == []
+
+
+async def worker_pid(request):
+    request.writer.write(str(os.getpid()).encode())
+    await asyncio.sleep(float(request.headers['agi_arg_1']))
+
+
+def agi_call(port, delay=0):
+    for i in range(50):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            time.sleep(.1)
+        else:
+            break
+    with sock:
+        sock.sendall(b'agi_network_script: worker_pid\nagi_arg_1: %s\n\n'
+                     % str(delay).encode())
+        data = b''
+        while True:
+            chunk = sock.recv(100)
+            if not chunk:
+                return data
+            data += chunk
+
+
+@pytest.mark.parametrize('reuse_port', [False, True])
+def test_serve(unused_tcp_port, reuse_port):
+    if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):  # pragma: no cover
+        pytest.skip('SO_REUSEPORT is not supported')
+    fa_app = Application()
+    fa_app.add_route('worker_pid', worker_pid)
+    server = multiprocessing.get_context('fork').Process(
+        target=fa_app.serve,
+        kwargs=dict(host='127.0.0.1', port=unused_tcp_port, workers=2,
+                    reuse_port=reuse_port))
+    server.start()
+    try:
+        pids = {agi_call(unused_tcp_port) for i in range(20)}
+        assert pids
+        assert str(server.pid).encode() not in pids
+
+        # a running request is served by the old worker during a reload
+        with ThreadPoolExecutor(1) as executor:
+            running = executor.submit(agi_call, unused_tcp_port, .5)
+            time.sleep(.2)
+            os.kill(server.pid, signal.SIGHUP)
+            assert running.result() in pids
+        time.sleep(.2)
+        new_pids = {agi_call(unused_tcp_port) for i in range(20)}
+        assert not new_pids & pids
+    finally:
+        server.terminate()
+        server.join(5)
+    assert server.exitcode == 0
+
+
+def feed(payload):
+    reader = asyncio.StreamReader()
+    reader.feed_data(payload)
+    return reader
+
+
+@pytest.mark.asyncio
+async def test_max_requests(event_loop):
+    started = []
+    release = event_loop.create_future()
+
+    async def slow(request):
+        started.append(request)
+        await release
+
+    async def busy(request):
+        request.writer.write(b'EXEC Playback busy\n')
+
+    fa_app = Application(loop=event_loop, max_requests=3,
+                         overload_route='busy')
+    fa_app.add_route('call_waiting', slow, max_requests=2)
+    fa_app.add_route('invalid', slow)
+    fa_app.add_route('busy', busy)
+    writers = [Writer() for i in range(5)]
+    tasks = [
+        event_loop.create_task(fa_app.handler(feed(payload), writer))
+        for payload, writer in zip(
+            [FAST_AGI_PAYLOAD] * 3 + [FAST_AGI_ERROR_PAYLOAD] * 2, writers)]
+    await asyncio.sleep(.01)
+    # 2 call_waiting and 1 invalid are running
+    assert len(started) == 3
+    assert fa_app.active == 3
+    assert fa_app.rejected == 2
+    assert writers[2].data == [b'EXEC Playback busy\n']
+    assert writers[2].closed
+
+    release.set_result(None)
+    await asyncio.gather(*tasks)
+    assert fa_app.active == 0
+    await fa_app.handler(feed(FAST_AGI_PAYLOAD), Writer())
+    assert len(started) == 4
+
+
+@pytest.mark.asyncio
+async def test_overloaded_hangup(event_loop):
+    fa_app = Application(loop=event_loop, max_requests=1)
+    fa_app.add_route('call_waiting', call_waiting)
+    fa_app.active = 1
+    writer = Writer()
+    await fa_app.handler(feed(FAST_AGI_PAYLOAD), writer)
+    assert writer.data == [b'HANGUP\n']
+    assert fa_app.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_timeouts(event_loop):
+    fa_app = Application(loop=event_loop, headers_timeout=.01,
+                         command_timeout=.01, request_timeout=.05)
+    writer = Writer()
+    assert await fa_app.read_headers(feed(b'agi_network: yes\n'),
+                                     writer) is None
+
+    request = Request(fa_app, {}, feed(b''), Writer())
+    with pytest.raises(asyncio.TimeoutError):
+        await request.send_command('ANSWER')
+
+    cancelled = []
+
+    async def sleep(request):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(request)
+            raise
+
+    fa_app.add_route('call_waiting', sleep)
+    await fa_app.handler(feed(FAST_AGI_PAYLOAD), writer)
+    assert len(cancelled) == 1
+    assert fa_app.active == 0
+    assert writer.closed
+
+
+def test_router():
+    router = Router()
+    router.add('tenant/{tenant:int}/ivr/{menu}')
+    router.add('tenant/{tenant:int}/ivr/main')
+    router.add('tenant/{name}/ivr/{menu}')
+    assert len(router) == 3
+    assert router.match('tenant/1/ivr/main') == (
+        'tenant/{tenant:int}/ivr/main', {'tenant': 1})
+    assert router.match('tenant/1/ivr/sales') == (
+        'tenant/{tenant:int}/ivr/{menu}', {'tenant': 1, 'menu': 'sales'})
+    assert router.match('tenant/acme/ivr/sales') == (
+        'tenant/{name}/ivr/{menu}', {'name': 'acme', 'menu': 'sales'})
+    assert router.match('tenant/\u00b2/ivr/main') == (
+        'tenant/{name}/ivr/{menu}', {'name': '\u00b2', 'menu': 'main'})
+    assert router.match('tenant/\u0661/ivr/main')[0] == (
+        'tenant/{name}/ivr/{menu}')
+    assert router.match('tenant//ivr/sales') is None
+    assert router.match('tenant/1/ivr') is None
+    router.remove('tenant/{tenant:int}/ivr/main')
+    assert router.match('tenant/1/ivr/main')[0] == (
+        'tenant/{tenant:int}/ivr/{menu}')
+    with pytest.raises(ValueError):
+        router.add('tenant/{name}/ivr/{menu}')
+    with pytest.raises(ValueError):
+        router.add('tenant/{id:uuid}')
+    with pytest.raises(ValueError):
+        router.add('record/{file:path}/info')
+
+
+@pytest.mark.asyncio
+async def test_route_templates(event_loop):
+    requests = []
+
+    async def endpoint(request):
+        requests.append(request)
+
+    fa_app = Application(loop=event_loop)
+    fa_app.add_route('call_{id}', endpoint)
+    fa_app.add_route('{name}', endpoint, max_requests=1)
+    fa_app.add_route('call_waiting', call_waiting)
+    await fa_app.handler(feed(FAST_AGI_ERROR_PAYLOAD), Writer())
+    assert requests[0].params == {'name': 'invalid'}
+    assert fa_app._route_active['{name}'] == 0
+
+    fa_app.del_route('{name}')
+    await fa_app.handler(feed(FAST_AGI_ERROR_PAYLOAD), Writer())
+    assert len(requests) == 1
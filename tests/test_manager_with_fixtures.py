@@ -2,8 +2,11 @@
 import os
 import pytest
 import asyncio
+import time
 from panoramisk import testing
 from panoramisk import message
+from panoramisk import actions
+from panoramisk.metrics import Metrics
 
 test_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
 
@@ -182,3 +185,190 @@ def test_pinger(manager):
     assert isinstance(manager.pinger, asyncio.TimerHandle)
     manager.close()
     assert manager.pinger is None
+
+
+def test_events_index(manager):
+    manager = manager()
+
+    def callback(manager, event):
+        pass
+
+    manager.register_event('*', callback)
+    manager.register_event('QueueMember', callback)
+    manager.register_event('Queue*', callback)
+    manager.register_event('Queue[MS]*', callback)
+    event = message.Message.from_line('Event: QueueMemberStatus')
+    assert manager.dispatch(event) == ['*', 'Queue*', 'Queue[MS]*']
+    event = message.Message.from_line('Event: QueueMember')
+    assert manager.dispatch(event) == [
+        '*', 'QueueMember', 'Queue*', 'Queue[MS]*']
+    assert 'QueueMember' in manager.matches_cache
+
+    # cache is cleared when a new pattern is registered
+    manager.register_event('QueueMem*', callback)
+    assert manager.matches_cache == {}
+    assert manager.dispatch(event) == [
+        '*', 'QueueMember', 'Queue*', 'Queue[MS]*', 'QueueMem*']
+
+
+def test_events_filter(manager):
+    manager = manager(events_filter=True)
+    manager.register_event('Queue*', lambda manager, event: None)
+    assert manager.filters == set()
+
+    future = manager.loop.create_future()
+    future.set_result(message.Message({'Response': 'Success'}))
+    assert manager.login(future) is True
+    assert sorted(manager.filters) == [
+        '^Event: AsyncAGI',
+        '^Event: FullyBooted[[:space:]]',
+        '^Event: OriginateResponse[[:space:]]',
+        '^Event: Queue',
+        '^Event: Shutdown[[:space:]]',
+    ]
+
+    manager.register_event('PeerStatus', lambda manager, event: None)
+    assert '^Event: PeerStatus[[:space:]]' in manager.filters
+    sent = b''.join(manager.protocol.outgoing)
+    assert sent.count(b'Action: Filter') == 6
+
+
+@pytest.mark.asyncio
+async def test_send_awaiting_actions(manager):
+    manager = manager(awaiting_actions_rate=1000)
+    manager.awaiting_actions.append(
+        actions.Action({'Action': 'Originate'}, replay_ttl=0))
+    manager.awaiting_actions.append(actions.Action({'Action': 'Setvar'}))
+    manager.awaiting_actions.append(actions.Action({'Action': 'Ping'}))
+    await manager.send_awaiting_actions()
+    assert len(manager.awaiting_actions) == 0
+    assert manager.awaiting_actions.expired == 1
+    sent = b''.join(manager.protocol.outgoing)
+    assert b'Action: Setvar' in sent
+    assert b'Action: Originate' not in sent
+    assert b'Action: Ping' not in sent
+
+
+@pytest.mark.asyncio
+async def test_events_in_thread(manager):
+    manager = manager()
+    future = manager.loop.create_future()
+
+    @manager.register_event('Peer*', mode='thread')
+    def callback(manager, event):
+        manager.loop.call_soon_threadsafe(future.set_result, event)
+
+    event = message.Message({'Event': 'PeerStatus'})
+    manager.dispatch(event)
+    assert await future is event
+
+
+@pytest.mark.asyncio
+async def test_lazy_events_in_threads(manager):
+    manager = manager()
+    future = manager.loop.create_future()
+
+    @manager.register_event('Peer*', mode='thread')
+    def callback(manager, event):
+        manager.loop.call_soon_threadsafe(future.set_result, event.peer)
+
+    event = message.Message.from_line('Event: PeerStatus\nPeer: gawel')
+    manager.dispatch(event)
+    # parsed before being used in the thread
+    assert event._frame is None
+    assert await future == 'gawel'
+
+
+def test_coroutine_in_threads(manager):
+    manager = manager()
+
+    async def callback(manager, event):
+        pass
+
+    with pytest.raises(ValueError):
+        manager.register_event('Peer*', callback, mode='thread')
+    manager.register_event('Hangup', lambda manager, event: None,
+                           mode='thread')
+    with pytest.raises(ValueError):
+        manager.register_event('Hangup', callback)
+
+
+@pytest.mark.asyncio
+async def test_events_in_tasks(manager):
+    manager = manager()
+    running = []
+    max_running = []
+
+    @manager.register_event('Peer*', mode='task', concurrency=2)
+    async def callback(manager, event):
+        running.append(event)
+        max_running.append(len(running))
+        await asyncio.sleep(.01)
+        running.remove(event)
+
+    for i in range(5):
+        manager.dispatch(message.Message({'Event': 'PeerStatus'}))
+    assert len(manager.tasks) == 2
+    await manager.task_queues['Peer*'][0].join()
+    assert max(max_running) == 2
+    assert len(max_running) == 5
+    manager.close()
+    await asyncio.sleep(0)
+    assert all(task.cancelled() for task in manager.tasks)
+
+
+@pytest.mark.asyncio
+async def test_events_backlog(manager):
+    metrics = Metrics()
+    manager = manager(callback_concurrency=1, callback_backlog=10,
+                      metrics=metrics)
+    handled = []
+
+    @manager.register_event('Peer*', mode='task')
+    async def callback(manager, event):
+        await asyncio.sleep(0)
+        handled.append(event)
+
+    for i in range(1000):
+        manager.dispatch(message.Message({'Event': 'PeerStatus'}))
+    assert len(manager.tasks) == 1
+    await manager.task_queues['Peer*'][0].join()
+    assert len(handled) == 10
+    assert metrics.get('panoramisk_dropped_events_total',
+                       event='PeerStatus') == 990
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_coroutine_callback(manager, caplog):
+    manager = manager(slow_callback_duration=.05)
+    done = asyncio.Event()
+
+    @manager.register_event('Peer*')
+    async def callback(manager, event):
+        await asyncio.sleep(0)
+        time.sleep(.1)
+        done.set()
+
+    manager.dispatch(message.Message({'Event': 'PeerStatus'}))
+    await done.wait()
+    await asyncio.sleep(0)
+    assert 'took' in caplog.text
+
+
+def test_slow_callback(manager, caplog):
+    manager = manager(slow_callback_duration=0)
+
+    @manager.register_event('Peer*')
+    def callback(manager, event):
+        pass
+
+    manager.dispatch(message.Message({'Event': 'PeerStatus'}))
+    assert 'took' in caplog.text
+    assert 'callback' in caplog.text
+
+
+def test_invalid_mode(manager):
+    manager = manager()
+    with pytest.raises(ValueError):
+        manager.register_event('Peer*', mode='process')
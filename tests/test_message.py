@@ -50,3 +50,33 @@ def test_getdict(msg):
     for k, v in msg.getdict('chanvariable').items():
         assert isinstance(k, str)
         assert isinstance(v, str)
+
+
+def test_lazy(message):
+    m = message('''\
+Event: Newexten
+Channel: SIP/000000
+''')
+    assert m._frame is not None
+    assert m.event == 'Newexten'
+    assert m.id is None
+    assert m._frame is not None
+    assert m.channel == 'SIP/000000'
+    assert m._frame is None
+    with pytest.raises(AttributeError):
+        m.unknown_attribute = True
+    assert isinstance(m, utils.CaseInsensitiveDict)
+
+
+def test_lazy_id(message):
+    m = message('''\
+Response: Success
+actionid: action/1
+''')
+    assert m.id == 'action/1'
+    assert m.action_id == 'action/1'
+    assert m.success
+
+
+def test_no_event_or_response(message):
+    assert message('Asterisk Call Manager/5.0.1') is None
@@ -0,0 +1,96 @@
+import pytest
+from panoramisk import testing
+from panoramisk import utils
+from panoramisk.actions import Action
+from panoramisk.cluster import Cluster
+from panoramisk.metrics import Metrics
+from panoramisk.pool import PoolManager
+
+
+@pytest.fixture
+def manager(event_loop):
+    metrics = Metrics()
+    manager = testing.Manager(loop=event_loop, metrics=metrics)
+    return manager
+
+
+def test_events(manager):
+    metrics = manager.metrics
+    manager.register_event('Peer*', lambda manager, event: None)
+    data = ('Event: PeerStatus' + utils.EOL * 2).encode()
+    manager.protocol.data_received(data * 2)
+    assert metrics.get('panoramisk_events_total', event='PeerStatus') == 2
+    assert metrics.get('panoramisk_bytes_received_total') == len(data) * 2
+    assert metrics.get('panoramisk_frame_classify_seconds')[1] == 2
+    callbacks = metrics.histograms['panoramisk_callback_seconds']
+    assert [count for __, __, count in callbacks.values()] == [2]
+
+
+def test_actions(manager):
+    metrics = manager.metrics
+    action = manager.protocol.send({'Action': 'Ping'})
+    assert metrics.get('panoramisk_pending_actions') == 1
+    data = utils.EOL.join([
+        'Response: Success', 'ActionID: %s' % action.action_id, 'Ping: Pong',
+    ]) + utils.EOL * 2
+    manager.protocol.data_received(data.encode())
+    assert action.done()
+    assert metrics.get('panoramisk_pending_actions') == 0
+    assert metrics.get('panoramisk_action_seconds', action='Ping')[1] == 1
+    assert metrics.get('panoramisk_awaiting_actions') == 0
+
+
+def test_stale_actions(manager):
+    metrics = manager.metrics
+    old = manager.protocol.send({'Action': 'Originate', 'ActionID': '1'})
+    manager.protocol.send({'Action': 'Status', 'ActionID': '2'})
+    assert metrics.get('panoramisk_stale_actions') == 0
+    old.sent_at -= manager.config['stale_action_delay'] + 1
+    assert metrics.get('panoramisk_stale_actions') == 1
+
+
+@pytest.mark.asyncio
+async def test_awaiting_actions(event_loop):
+    metrics = Metrics()
+    manager = testing.Manager(loop=event_loop, metrics=metrics,
+                              awaiting_actions_maxsize=1,
+                              awaiting_actions_ttl=0)
+    manager.awaiting_actions.append(Action({'Action': 'Ping'}))
+    manager.awaiting_actions.append(Action({'Action': 'Ping'}))
+    assert metrics.get('panoramisk_awaiting_actions') == 1
+    assert metrics.get('panoramisk_awaiting_actions_dropped') == 1
+    await manager.send_awaiting_actions()
+    assert metrics.get('panoramisk_awaiting_actions_expired') == 1
+
+
+def test_shared_registry(event_loop):
+    metrics = Metrics()
+    pool = PoolManager(loop=event_loop, metrics=metrics, pool_size=2)
+    cluster = Cluster(loop=event_loop, metrics=metrics)
+    cluster.add_node('pbx1')
+    pool.pool[1].awaiting_actions.append(Action({'Action': 'Ping'}))
+    assert metrics.get('panoramisk_awaiting_actions',
+                       connection='events') == 0
+    assert metrics.get('panoramisk_awaiting_actions', connection='1') == 1
+    assert metrics.get('panoramisk_pending_actions', node='pbx1') == 0
+    assert len(metrics.gauges['panoramisk_pending_actions']) == 4
+
+
+def test_prometheus():
+    metrics = Metrics(buckets=[.1, 1])
+    metrics.inc('requests_total', path='a"b')
+    metrics.observe('latency_seconds', .5)
+    metrics.observe('latency_seconds', 2.)
+    metrics.gauge('queue_size', lambda: 3)
+    assert metrics.prometheus() == '''\
+# TYPE requests_total counter
+requests_total{path="a\\"b"} 1
+# TYPE queue_size gauge
+queue_size 3
+# TYPE latency_seconds histogram
+latency_seconds_bucket{le="0.1"} 0
+latency_seconds_bucket{le="1"} 1
+latency_seconds_bucket{le="+Inf"} 2
+latency_seconds_sum 2.5
+latency_seconds_count 2
+'''
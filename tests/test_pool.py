@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from panoramisk import testing
+from panoramisk import utils
+from panoramisk.ami_protocol import AMIProtocol
+from panoramisk.pool import PoolManager
+from panoramisk.recording import Recorder
+
+
+@pytest.fixture
+def manager(event_loop):
+    def manager(**config):
+        manager = PoolManager(loop=event_loop, **config)
+        for m in [manager] + manager.pool:
+            m.protocol = AMIProtocol()
+            m.protocol.connection_made(testing.MagicMock())
+            m.protocol.loop = event_loop
+        return manager
+    return manager
+
+
+def test_record_events_connection(manager, tmpdir):
+    recorder = Recorder(str(tmpdir.join('ami.rec')))
+    manager = manager(pool_size=2, record=recorder)
+    assert manager.recorder is recorder
+    assert [m.recorder for m in manager.pool] == [None, None]
+    recorder.close()
+
+
+def test_round_robin(manager):
+    manager = manager(pool_size=2)
+    first = manager.send_action({'Action': 'Ping'})
+    second = manager.send_action({'Action': 'Ping'})
+    third = manager.send_action({'Action': 'Ping'})
+    pool = manager.pool
+    assert first.id in pool[1].protocol.responses
+    assert second.id in pool[0].protocol.responses
+    assert third.id in pool[1].protocol.responses
+    assert manager.protocol.responses == {}
+
+
+def test_least_pending(manager):
+    manager = manager(pool_size=2, pool_routing='least_pending')
+    pool = manager.pool
+    pool[0].send_action({'Action': 'Ping'})
+    action = manager.send_action({'Action': 'Ping'})
+    assert action.id in pool[1].protocol.responses
+
+
+def test_fallback_to_events_connection(manager):
+    manager = manager(pool_size=2)
+    for m in manager.pool:
+        m.protocol.closed = True
+    action = manager.send_action({'Action': 'Ping'})
+    assert action.id in manager.protocol.responses
+
+
+def test_invalid_routing(event_loop):
+    with pytest.raises(ValueError):
+        PoolManager(loop=event_loop, pool_routing='random')
+
+
+def test_close(manager):
+    manager = manager(pool_size=2)
+    manager.close()
+    assert all(m.protocol.closed for m in manager.pool)
+
+
+@pytest.mark.asyncio
+async def test_events_connection_lost(event_loop, monkeypatch):
+    monkeypatch.setattr(utils, 'EOL', '\r\n')
+    server = testing.AMIServer(username='user', secret='secret')
+    manager = PoolManager(loop=event_loop, port=await server.start(),
+                          username='user', secret='secret',
+                          reconnect_timeout=0)
+    await manager.connect()
+    while not all(m.authenticated for m in [manager] + manager.pool):
+        await asyncio.sleep(.01)
+    events = manager.protocol
+    protocols = [m.protocol for m in manager.pool]
+    events.transport.close()
+    while manager.protocol is events or not manager.authenticated:
+        await asyncio.sleep(.01)
+    assert [m.protocol for m in manager.pool] == protocols
+    assert not any(protocol.closed for protocol in protocols)
+    manager.close()
+    server.close()
@@ -1,6 +1,14 @@
 from panoramisk import testing
+from panoramisk import utils
+from panoramisk import Manager
+from panoramisk.actions import Action
+from panoramisk.ami_protocol import AMIProtocol
+from panoramisk.message import Message
+from panoramisk.metrics import Metrics
 import asyncio
+import gc
 import pytest
+import weakref
 
 
 @pytest.fixture
@@ -24,3 +32,163 @@ def test_received(conn):
 
 def test_send(conn):
     assert isinstance(conn.send({}), asyncio.Future)
+
+
+def test_received_fragmented(conn):
+    events = []
+    conn.factory.register_event('Peer*', lambda m, e: events.append(e))
+    eol = utils.EOL
+    frame = ('Event: PeerStatus' + eol + 'Peer: gawel' + eol + eol).encode()
+    for i in range(len(frame * 2)):
+        conn.data_received((frame * 2)[i:i + 1])
+    assert len(events) == 2
+    assert events[0].peer == 'gawel'
+    assert conn.buffer == b''
+
+
+def test_received_coalesced(conn):
+    events = []
+    conn.factory.register_event('Peer*', lambda m, e: events.append(e))
+    eol = utils.EOL
+    frame = ('Event: PeerStatus' + eol + 'Peer: gawel' + eol + eol).encode()
+    conn.data_received(frame * 3 + frame[:10])
+    assert len(events) == 3
+    conn.data_received(frame[10:])
+    assert len(events) == 4
+
+
+@pytest.mark.asyncio
+async def test_send_batching(event_loop):
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    conn.send({'Action': 'Ping'})
+    conn.send({'Action': 'Ping'})
+    assert not conn.transport.write.called
+    await asyncio.sleep(0)
+    assert conn.transport.write.call_count == 1
+    data = conn.transport.write.call_args[0][0]
+    assert data.count(b'Action: Ping') == 2
+
+
+def test_send_then_close():
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.send({'Action': 'Logoff'})
+    conn.close()
+    assert conn.transport.write.call_count == 1
+    assert b'Action: Logoff' in conn.transport.write.call_args[0][0]
+    assert conn.transport.close.called
+    assert conn.outgoing == []
+
+
+def test_connection_lost_drops_outgoing():
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.factory = testing.MagicMock()
+    conn.send({'Action': 'Ping'})
+    conn.connection_lost(None)
+    assert not conn.transport.write.called
+    assert conn.factory.connection_lost.called
+
+
+def test_send_keeps_action_stream(conn):
+    action = conn.send(Action({'Action': 'QueueStatus'}, stream=True))
+    assert action.stream is True
+    action = conn.send(Action({'Action': 'QueueStatus'}, stream=True),
+                       stream=False)
+    assert action.stream is False
+    assert conn.send({'Action': 'QueueStatus'}, stream=True).stream is True
+
+
+@pytest.mark.asyncio
+async def test_send_flow_control(event_loop):
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    conn.pause_writing()
+    conn.send({'Action': 'Ping'})
+    drain = asyncio.ensure_future(conn.drain())
+    await asyncio.sleep(0)
+    assert not conn.transport.write.called
+    assert not drain.done()
+    conn.resume_writing()
+    await drain
+    assert conn.transport.write.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_response_timeout(event_loop):
+    metrics = Metrics()
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    conn.metrics = metrics
+    slow = conn.send({'Action': 'Originate'}, response_timeout=.05)
+    fast = conn.send({'Action': 'Status'}, response_timeout=.01)
+    other = conn.send({'Action': 'Ping'})
+    assert conn.timer.when() == pytest.approx(event_loop.time() + .01,
+                                              abs=.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await fast
+    assert slow.id in conn.responses
+    with pytest.raises(asyncio.TimeoutError):
+        await slow
+    assert list(conn.responses) == [other.id]
+    assert conn.timer is None
+    assert metrics.get('panoramisk_action_timeouts_total',
+                       action='Originate') == 1
+
+
+@pytest.mark.asyncio
+async def test_response_timeout_released(event_loop):
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    action = conn.send({'Action': 'Ping'}, response_timeout=60)
+    ref = weakref.ref(action)
+    conn.forget(action)
+    action.set_result(Message({'Response': 'Success'}))
+    await asyncio.sleep(0)
+    del action
+    gc.collect()
+    assert ref() is None
+    assert len(conn.timeouts) == 1
+    conn.check_timeouts()
+
+
+@pytest.mark.asyncio
+async def test_close_fails_dropped_actions(event_loop):
+    manager = Manager(loop=event_loop, response_timeout=.05)
+    conn = manager.protocol = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    conn.factory = manager
+    conn.config = manager.config
+    ping = conn.send({'Action': 'Ping', 'ActionID': '1'})
+    status = conn.send({'Action': 'QueueStatus', 'ActionID': '2'},
+                       as_list=True)
+    command = conn.send({'Action': 'Command', 'Command': 'core show help',
+                         'ActionID': '3'})
+    eol = utils.EOL
+    conn.data_received(eol.join([
+        'Response: Success', 'ActionID: 2', 'EventList: start',
+    ]).encode() + (eol * 2).encode())
+    conn.connection_lost(None)
+    manager.close()
+    for action in (ping, status):
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(action, .2)
+    assert list(manager.awaiting_actions) == [command]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_action_is_forgotten(event_loop):
+    conn = AMIProtocol()
+    conn.connection_made(testing.MagicMock())
+    conn.loop = event_loop
+    action = conn.send({'Action': 'Originate'})
+    assert action.id in conn.responses
+    action.cancel()
+    await asyncio.sleep(0)
+    assert conn.responses == {}
@@ -0,0 +1,79 @@
+import os
+import pytest
+from panoramisk import Manager
+from panoramisk import testing
+from panoramisk import utils
+from panoramisk.recording import Recorder
+from panoramisk.recording import read_records
+from panoramisk.recording import replay
+
+
+def frame(name):
+    return ('Event: %s' % name + utils.EOL * 2).encode()
+
+
+@pytest.mark.asyncio
+async def test_record(event_loop, tmpdir):
+    path = str(tmpdir.join('ami.rec'))
+    manager = testing.Manager(loop=event_loop, record=path)
+    manager.protocol.data_received(frame('PeerStatus'))
+    manager.protocol.data_received(frame('Hangup'))
+    assert not os.path.exists(path)
+    manager.recorder.close()
+    records = list(read_records(path))
+    assert [data for __, data in records] == [
+        frame('PeerStatus'), frame('Hangup')]
+    assert records[0][0] <= records[1][0]
+
+
+@pytest.mark.asyncio
+async def test_close_recorder(event_loop, tmpdir):
+    path = str(tmpdir.join('ami.rec'))
+    manager = testing.Manager(loop=event_loop, record=path)
+    recorder = manager.recorder
+    manager.protocol.data_received(frame('Hangup'))
+    manager.close()
+    assert manager.recorder is None
+    assert recorder.fd is None
+    with pytest.raises(RuntimeError):
+        recorder.executor.submit(print)
+    assert len(list(read_records(path))) == 1
+
+    # recorders passed to the manager are only flushed
+    recorder = Recorder(path)
+    manager = testing.Manager(loop=event_loop, record=recorder)
+    manager.protocol.data_received(frame('Hangup'))
+    manager.close()
+    assert manager.recorder is recorder
+    recorder.executor.submit(print).result()
+    assert len(list(read_records(path))) == 2
+    recorder.close()
+
+
+@pytest.mark.asyncio
+async def test_rotate(event_loop, tmpdir):
+    path = str(tmpdir.join('ami.rec'))
+    recorder = Recorder(path, max_bytes=50, backup_count=2, buffer_size=1)
+    for i in range(4):
+        recorder.write(frame('Hangup'))
+    recorder.close()
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'ami.rec', 'ami.rec.1', 'ami.rec.2']
+    assert len(list(read_records(path))) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('speed', [None, 1000])
+async def test_replay(event_loop, tmpdir, speed):
+    path = str(tmpdir.join('ami.rec'))
+    recorder = Recorder(path)
+    for i in range(10):
+        recorder.write(frame('PeerStatus'))
+    recorder.close()
+
+    events = []
+    manager = Manager(loop=event_loop)
+    manager.register_event('Peer*', lambda manager, event: events.append(event))
+    assert await replay(manager, path, speed=speed) == 10
+    assert len(events) == 10
+    manager.close()
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from panoramisk import testing
+from panoramisk.message import Message
+
+
+@pytest.fixture
+def manager(event_loop):
+    return testing.Manager(loop=event_loop)
+
+
+def event(name, **headers):
+    headers['Event'] = name
+    return Message(headers)
+
+
+@pytest.mark.asyncio
+async def test_events(manager):
+    received = []
+
+    async def consume():
+        async with manager.events('Queue*') as events:
+            async for e in events:
+                received.append(e)
+                if len(received) == 2:
+                    break
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0)
+    manager.dispatch(event('QueueMemberStatus'))
+    manager.dispatch(event('Hangup'))
+    manager.dispatch(event('QueueCallerJoin'))
+    await task
+    assert [e.event for e in received] == [
+        'QueueMemberStatus', 'QueueCallerJoin']
+    assert manager.subscriptions == []
+    assert manager.match_patterns('QueueCallerJoin') == []
+
+
+@pytest.mark.parametrize('overflow,kept', [
+    ('drop_oldest', ['2', '3']),
+    ('drop_newest', ['1', '2']),
+])
+def test_overflow(manager, overflow, kept):
+    events = manager.events('Queue*', maxsize=2, overflow=overflow)
+    for i in range(1, 4):
+        manager.dispatch(event('QueueMember', Name=str(i)))
+    assert [e.name for e in events.queue.values()] == kept
+    assert events.received == 3
+    assert events.dropped == 1
+    assert events.lag == 2
+
+
+def test_coalesce(manager):
+    events = manager.events('QueueMemberStatus',
+                            coalesce=lambda e: e.interface)
+    manager.dispatch(event('QueueMemberStatus', Interface='A', Status='1'))
+    manager.dispatch(event('QueueMemberStatus', Interface='B', Status='1'))
+    manager.dispatch(event('QueueMemberStatus', Interface='A', Status='2'))
+    assert [(e.interface, e.status) for e in events.queue.values()] == [
+        ('A', '2'), ('B', '1')]
+    assert events.coalesced == 1
+
+
+def test_invalid_overflow(manager):
+    with pytest.raises(ValueError):
+        manager.events('Queue*', overflow='block')
+
+
+def test_unregister_event(manager):
+    def callback(manager, event):
+        pass
+
+    manager.register_event('Peer*', callback)
+    assert manager.match_patterns('PeerStatus') == ['Peer*']
+    manager.unregister_event('Peer*', callback)
+    assert manager.match_patterns('PeerStatus') == []
+    with pytest.raises(ValueError):
+        manager.unregister_event('Peer*', callback)
@@ -37,3 +37,22 @@ def try_parse_agi_result(result):
         res['msg'] = err.args[0]
 
     return res
+
+
+def test_case_insensitive_dict():
+    cid = utils.CaseInsensitiveDict({'Event': 'Hangup'}, Channel='SIP/1')
+    cid['X-Custom-Header'] = '1'
+    assert cid['event'] == cid.get('EVENT') == cid.event == 'Hangup'
+    assert cid.channel == 'SIP/1'
+    assert 'x-custom-header' in cid
+    assert cid.get('missing') is None
+    assert cid.missing == ''
+    assert sorted(cid) == ['Channel', 'Event', 'X-Custom-Header']
+
+
+def test_case_insensitive_dict_from_items():
+    cid = utils.CaseInsensitiveDict.from_items([('ActionID', '1'),
+                                                ('Response', 'Success')])
+    assert isinstance(cid, utils.CaseInsensitiveDict)
+    assert cid.actionid == '1'
+    assert dict(cid) == {'ActionID': '1', 'Response': 'Success'}